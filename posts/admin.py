@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Comment, Follow, Group, Post
+from .models import Comment, Follow, Group, Post, Task, UserStats
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -36,3 +36,22 @@ class FollowAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Follow, FollowAdmin)
+
+
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'posts_count', 'following_count', 'follower_count')
+    readonly_fields = ('posts_count', 'following_count', 'follower_count')
+    empty_value_display = '-пусто-'
+
+
+admin.site.register(UserStats, UserStatsAdmin)
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'name', 'status', 'attempts', 'run_at',
+                    'duration_ms')
+    list_filter = ('status', 'name')
+    empty_value_display = '-пусто-'
+
+
+admin.site.register(Task, TaskAdmin)
@@ -0,0 +1,120 @@
+"""
+JSON API только для чтения: ленты, пост и его комментарии.
+
+Страницы лент - те же keyset-курсоры, что и в HTML (?after= и
+?before=), комментарии - порции comment_batch(). Сериализаторы берут
+только поля, загруженные select_related, без запросов на строку.
+Ответы несут ETag и Last-Modified по версиям областей кэша (см.
+conditional_page), поэтому неизменившаяся страница отвечает 304,
+не обращаясь к базе.
+"""
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, set_response_etag
+
+from yatube.routers import replica_reads
+
+from .models import Comment, Group, Post, User
+from .page_cache import cache_anonymous_page, conditional_page
+from .paginator import (POSTS_PER_PAGE, KeysetPaginator, comment_batch,
+                        decode_cursor)
+from .timeline import TimelinePaginator
+
+
+def serialize_post(post):
+    return {
+        'id': post.pk,
+        'text': post.text,
+        'pub_date': post.pub_date.isoformat(),
+        'author': post.author.username,
+        'group': post.group.slug if post.group_id else None,
+        'image': post.image.url if post.image else None,
+        'comment_count': post.comment_count,
+        'version': post.version,
+    }
+
+
+def serialize_comment(comment):
+    return {
+        'id': comment.pk,
+        'text': comment.text,
+        'created': comment.created.isoformat(),
+        'author': comment.author.username,
+    }
+
+
+def feed_response(request, keyset):
+    page = keyset.page(
+        after=decode_cursor(request.GET.get('after')),
+        before=decode_cursor(request.GET.get('before')),
+    )
+    return JsonResponse({
+        'results': [serialize_post(post) for post in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def feed(queryset):
+    return KeysetPaginator(queryset, POSTS_PER_PAGE)
+
+
+@conditional_page('index')
+@cache_anonymous_page('index')
+@replica_reads
+def index(request):
+    return feed_response(request, feed(Post.objects.for_feed()))
+
+
+@conditional_page('group:{slug}')
+@cache_anonymous_page('group:{slug}')
+@replica_reads
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return feed_response(request, feed(group.posts.for_feed()))
+
+
+@conditional_page('profile:{username}')
+@cache_anonymous_page('profile:{username}')
+@replica_reads
+def profile(request, username):
+    author = get_object_or_404(User, username=username)
+    return feed_response(request, feed(author.posts.for_feed()))
+
+
+@replica_reads
+def follow_index(request):
+    """
+    Лента подписок собирается для читателя из постов многих авторов,
+    общей версии у неё нет: ETag считается по содержимому ответа,
+    304 экономит только передачу.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Нужна авторизация.'}, status=401)
+    response = feed_response(request, TimelinePaginator(request.user))
+    set_response_etag(response)
+    return get_conditional_response(
+        request, etag=response['ETag'], response=response
+    )
+
+
+@conditional_page('post:{post_id}')
+@cache_anonymous_page('post:{post_id}')
+def post_view(request, post_id):
+    post = get_object_or_404(Post.objects.for_feed(), pk=post_id)
+    return JsonResponse(serialize_post(post))
+
+
+@conditional_page('post:{post_id}')
+@cache_anonymous_page('post:{post_id}')
+def post_comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    comments, next_cursor = comment_batch(
+        Comment.objects.filter(post_id=post_id),
+        decode_cursor(request.GET.get('after')),
+    )
+    return JsonResponse({
+        'results': [serialize_comment(comment) for comment in comments],
+        'next': next_cursor,
+    })
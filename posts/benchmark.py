@@ -0,0 +1,226 @@
+"""
+Бенчмарк view приложения posts через тестовый клиент Django.
+
+Для каждого сценария измеряются перцентили задержки, число SQL-запросов
+на запрос и пик выделенной памяти. Результат - словарь, который
+команда benchmark сохраняет в JSON и сравнивает с базовой линией.
+
+write_burst() отдельно проверяет файл SQLite под конкурентной
+нагрузкой: сколько чтений главной страницы в секунду успевают
+читатели, пока писатели пачками добавляют комментарии.
+"""
+import sqlite3
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from itertools import count
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Comment, Group, Post, User, UserStats
+from .paginator import POSTS_PER_PAGE
+
+
+def percentile(values, fraction):
+    """
+    Перцентиль с линейной интерполяцией, values - непустой список.
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def scenarios():
+    """
+    Сценарии (имя, метод, url, данные, нужен ли вход) на самых
+    нагруженных объектах набора данных.
+    """
+    group = Group.objects.annotate(total=Count('posts')).order_by(
+        '-total'
+    ).first()
+    author = User.objects.get(pk=UserStats.objects.order_by(
+        '-posts_count'
+    ).values_list('user_id', flat=True)[0])
+    post = Post.objects.select_related('author').order_by(
+        '-comment_count', 'pk'
+    ).first()
+    reader = User.objects.get(pk=UserStats.objects.order_by(
+        '-follower_count'
+    ).values_list('user_id', flat=True)[0])
+    texts = (f'Бенчмарк {number}' for number in count())
+    return reader, [
+        ('index', 'get', reverse('index'), None, False),
+        ('group_posts', 'get', reverse('group', args=[group.slug]), None,
+         False),
+        ('profile', 'get', reverse('profile', args=[author.username]), None,
+         False),
+        ('post_view', 'get',
+         reverse('post', args=[post.author.username, post.pk]), None, False),
+        ('follow_index', 'get', reverse('follow_index'), None, True),
+        ('new_post', 'post', reverse('new_post'),
+         lambda: {'text': next(texts)}, True),
+        ('add_comment', 'post',
+         reverse('add_comment', args=[post.author.username, post.pk]),
+         lambda: {'text': next(texts)}, True),
+    ]
+
+
+def measure(client, method, url, data=None, repeat=20, cold_cache=False):
+    send = getattr(client, method)
+    timings = []
+    statuses = set()
+    query_count = 0
+    for _ in range(repeat):
+        if cold_cache:
+            cache.clear()
+        # Счётчик запросов нужен на каждый запрос отдельно: сигнал
+        # request_started очищает журнал запросов соединения.
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = send(url, data() if data else None)
+            timings.append((time.perf_counter() - started) * 1000)
+        query_count += len(queries)
+        statuses.add(response.status_code)
+    if cold_cache:
+        cache.clear()
+    tracemalloc.start()
+    try:
+        send(url, data() if data else None)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'requests': repeat,
+        'status': sorted(statuses),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(sum(timings) / repeat, 3),
+        'queries': round(query_count / repeat, 2),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run(repeat=20, warmup=2, cold_cache=False):
+    """
+    Прогоняет все сценарии: warmup запросов без замеров, затем repeat
+    измеряемых. Анонимные страницы по умолчанию отдаются из кэша,
+    как в продакшене; cold_cache очищает кэш перед каждым запросом.
+    """
+    reader, plan = scenarios()
+    anonymous, logged_in = Client(), Client()
+    logged_in.force_login(reader)
+    results = {}
+    for name, method, url, data, login in plan:
+        client = logged_in if login else anonymous
+        for _ in range(warmup):
+            getattr(client, method)(url, data() if data else None)
+        results[name] = measure(client, method, url, data, repeat,
+                                cold_cache)
+    return results
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Регрессии относительно базовой линии: p95 выросла больше чем
+    на threshold или стало больше запросов к базе.
+    """
+    regressions = []
+    for name, before in baseline.items():
+        after = current.get(name)
+        if after is None:
+            continue
+        if after['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(
+                f"{name}: p95 {before['p95_ms']} -> {after['p95_ms']} мс"
+            )
+        if after['queries'] > before['queries']:
+            regressions.append(
+                f"{name}: запросов {before['queries']} -> {after['queries']}"
+            )
+    return regressions
+
+
+def write_burst(path, pragmas, readers=4, writers=2, duration=3.0,
+                batch=20):
+    """
+    Нагружает файл SQLite path с прагмами pragmas: readers потоков
+    без пауз выполняют запрос первой страницы ленты, writers потоков
+    добавляют комментарии транзакциями по batch строк. Соединения
+    открываются как в Django: с ожиданием блокировки до 5 секунд.
+    """
+    from yatube.database import apply_pragmas
+
+    feed_sql = str(Post.objects.for_feed().order_by('-pub_date', '-id')
+                   [:POSTS_PER_PAGE + 1].query)
+    insert_sql = (f'INSERT INTO {Comment._meta.db_table} '
+                  '(post_id, author_id, text, created) VALUES (?, ?, ?, ?)')
+    stop = threading.Event()
+    lock = threading.Lock()
+    timings, errors, commits = [], [0], [0]
+
+    def connect():
+        connection = sqlite3.connect(path, timeout=5)
+        apply_pragmas(connection, pragmas)
+        return connection
+
+    def read():
+        connection = connect()
+        local = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                connection.execute(feed_sql).fetchall()
+            except sqlite3.OperationalError:
+                with lock:
+                    errors[0] += 1
+                continue
+            local.append((time.perf_counter() - started) * 1000)
+        connection.close()
+        with lock:
+            timings.extend(local)
+
+    def write():
+        connection = connect()
+        post_id, author_id = connection.execute(
+            f'SELECT id, author_id FROM {Post._meta.db_table} LIMIT 1'
+        ).fetchone()
+        while not stop.is_set():
+            rows = [(post_id, author_id, 'Нагрузка', datetime.now())
+                    for _ in range(batch)]
+            try:
+                with connection:
+                    for row in rows:
+                        connection.execute(insert_sql, row)
+            except sqlite3.OperationalError:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                commits[0] += 1
+        connection.close()
+
+    threads = ([threading.Thread(target=read) for _ in range(readers)]
+               + [threading.Thread(target=write) for _ in range(writers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    timings = timings or [0]
+    return {
+        'reads_per_s': round(len(timings) / duration, 1),
+        'read_p50_ms': round(percentile(timings, 0.50), 3),
+        'read_p99_ms': round(percentile(timings, 0.99), 3),
+        'write_commits_per_s': round(commits[0] / duration, 1),
+        'locked_errors': errors[0],
+    }
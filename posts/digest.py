@@ -0,0 +1,199 @@
+"""
+Дайджесты новых постов для подписчиков.
+
+Вместо письма на каждый пост каждому подписчику команда send_digests
+(её запускает cron с нужным периодом) отправляет одно письмо
+на подписчика со всеми новыми постами его авторов с прошлой рассылки.
+
+Память не зависит от числа подписчиков: подписчики читаются пачками
+по DIGEST_BATCH_SIZE по возрастанию id, в памяти - только текущая
+пачка и разделы авторов (не больше DIGEST_POSTS_PER_AUTHOR постов
+на автора). Текст письма зависит только от набора авторов, поэтому
+внутри пачки шаблон рендерится один раз на набор, а письма всех пачек
+уходят через одно соединение почтового бэкенда.
+
+Прогресс хранится в DigestRun после каждой пачки: прерванная
+рассылка продолжается со следующего подписчика. Пачка, отправленная
+перед самым сбоем, может уйти повторно. Команда захватывает рассылку
+на время (claim), поэтому запущенная поверх неё вторая команда
+ничего не отправит. Прогресс записывается, только пока захват
+не перехватила другая команда.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Q
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import DigestRun, Follow, Post, User
+
+SUBJECT = 'Новые посты в ваших подписках'
+
+
+def current_run():
+    """
+    Незавершённая рассылка или новая - для постов после прошлой.
+    Первый вызов только запоминает последний пост: о постах,
+    опубликованных до появления рассылки, подписчикам не пишем.
+    None - новых постов нет или новую рассылку уже создала другая
+    команда.
+    """
+    run = DigestRun.objects.filter(finished__isnull=True).first()
+    if run is not None:
+        return run
+    last_post_id = Post.objects.aggregate(last=Max('pk'))['last'] or 0
+    previous = DigestRun.objects.order_by('-pk').first()
+    if previous is None:
+        DigestRun.objects.create(first_post_id=last_post_id,
+                                 last_post_id=last_post_id,
+                                 finished=timezone.now())
+        return None
+    if last_post_id <= previous.last_post_id:
+        return None
+    try:
+        with transaction.atomic():
+            return DigestRun.objects.create(
+                previous=previous, first_post_id=previous.last_post_id,
+                last_post_id=last_post_id,
+            )
+    except IntegrityError:
+        return None
+
+
+def claim(run):
+    """
+    Захватывает рассылку на DIGEST_LEASE_SECONDS секунд условным
+    UPDATE. False - её ведёт другая команда. Если команда упала,
+    после истечения срока рассылку продолжит следующая.
+    """
+    now = timezone.now()
+    return DigestRun.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+        pk=run.pk, finished__isnull=True,
+    ).update(locked_until=now + timedelta(
+        seconds=settings.DIGEST_LEASE_SECONDS
+    )) == 1
+
+
+def sections(posts):
+    """
+    Разделы письма по авторам: последние DIGEST_POSTS_PER_AUTHOR
+    постов и их общее число.
+    """
+    domain = Site.objects.get_current().domain
+    totals = dict(posts.order_by().values_list('author_id').annotate(
+        total=Count('pk')
+    ))
+    result = {}
+    for post in posts.select_related('author').order_by(
+        'author_id', '-pk'
+    ).iterator():
+        section = result.setdefault(post.author_id, {
+            'author': post.author.username,
+            'total': totals[post.author_id],
+            'posts': [],
+        })
+        if len(section['posts']) < settings.DIGEST_POSTS_PER_AUTHOR:
+            section['posts'].append({
+                'text': post.text,
+                'url': 'https://' + domain + reverse(
+                    'post', args=[post.author.username, post.pk]
+                ),
+            })
+    return result
+
+
+def batches(authors, after, batch_size):
+    """
+    Подписчики авторов authors (подзапрос) с id больше after:
+    пачки [(id, email, [id авторов]), ...].
+    """
+    while True:
+        user_ids = list(Follow.objects.filter(
+            author_id__in=authors, user_id__gt=after
+        ).order_by('user_id').values_list('user_id', flat=True).distinct()[
+            :batch_size
+        ])
+        if not user_ids:
+            return
+        followed = {}
+        for user_id, author_id in Follow.objects.filter(
+            user_id__in=user_ids, author_id__in=authors
+        ).order_by('user_id', 'author_id').values_list('user_id',
+                                                       'author_id'):
+            followed.setdefault(user_id, []).append(author_id)
+        emails = dict(User.objects.filter(pk__in=user_ids).exclude(
+            email=''
+        ).values_list('pk', 'email'))
+        yield user_ids[-1], [(user_id, emails[user_id], followed[user_id])
+                             for user_id in user_ids if user_id in emails]
+        after = user_ids[-1]
+
+
+def send_digests(batch_size=None):
+    """
+    Отправляет дайджесты текущей рассылки. Возвращает число писем.
+    """
+    run = current_run()
+    if run is None or not claim(run):
+        return 0
+    run.refresh_from_db()
+    posts = Post.objects.filter(pk__gt=run.first_post_id,
+                                pk__lte=run.last_post_id)
+    authors = posts.order_by().values('author_id')
+    by_author = sections(posts)
+    connection = get_connection()
+    connection.open()
+    try:
+        for last_user_id, followers in batches(
+            authors, run.last_user_id,
+            batch_size or settings.DIGEST_BATCH_SIZE
+        ):
+            bodies = {}
+            messages = []
+            for user_id, email, author_ids in followers:
+                # Посты, удалённые после начала рассылки, пропускаются.
+                key = tuple(author_id for author_id in author_ids
+                            if author_id in by_author)
+                if not key:
+                    continue
+                if key not in bodies:
+                    bodies[key] = render_to_string('emails/digest.txt', {
+                        'sections': [by_author[author_id]
+                                     for author_id in key],
+                    })
+                messages.append(EmailMessage(
+                    SUBJECT, bodies[key], settings.DEFAULT_FROM_EMAIL,
+                    [email], connection=connection,
+                ))
+            connection.send_messages(messages)
+            run.sent += len(messages)
+            locked_until = timezone.now() + timedelta(
+                seconds=settings.DIGEST_LEASE_SECONDS
+            )
+            if not held(run, last_user_id=last_user_id, sent=run.sent,
+                        locked_until=locked_until):
+                return run.sent
+            run.last_user_id = last_user_id
+            run.locked_until = locked_until
+    finally:
+        connection.close()
+    held(run, finished=timezone.now(), locked_until=None)
+    return run.sent
+
+
+def held(run, **changes):
+    """
+    Записывает changes, только если рассылка всё ещё захвачена этой
+    командой (срок захвата не менялся). False - команда зависла дольше
+    DIGEST_LEASE_SECONDS и рассылку продолжает другая: её прогресс
+    не перезаписывается.
+    """
+    return DigestRun.objects.filter(
+        pk=run.pk, locked_until=run.locked_until
+    ).update(**changes) == 1
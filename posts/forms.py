@@ -8,6 +8,15 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ['group', 'text', 'image']
 
+    def clean(self):
+        # Файл, отклонённый ImageUploadHandler, приходит пустым,
+        # вместо общей ошибки ImageField показываем причину.
+        error = getattr(self.files.get('image'), 'upload_error', None)
+        if error:
+            self.errors.pop('image', None)
+            self.add_error('image', error)
+        return super().clean()
+
 
 class CommentForm(forms.ModelForm):
     class Meta():
@@ -0,0 +1,46 @@
+import fcntl
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import writequeue
+
+
+class Command(BaseCommand):
+    help = ('Применяет операции из журнала отложенной записи пачками, '
+            'по одной транзакции на пачку')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=writequeue.BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=0.5,
+                            help='пауза, когда журнал пуст, секунды')
+        parser.add_argument('--once', action='store_true',
+                            help='разобрать журнал и выйти')
+
+    def handle(self, *args, **options):
+        # Воркер один: так операции применяются в порядке поступления.
+        lock = open(settings.WRITE_QUEUE_PATH + '.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise CommandError('Журнал уже разбирает другой воркер.')
+        applied = 0
+        try:
+            while True:
+                count = writequeue.apply_pending(options['batch_size'])
+                applied += count
+                if count:
+                    continue
+                writequeue.prune_keys()
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            lock.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Применено операций: {applied}'
+        ))
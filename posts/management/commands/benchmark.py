@@ -0,0 +1,83 @@
+import json
+import platform
+import shutil
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from posts import benchmark, synthetic
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число запросов и память view posts '
+            'на синтетических данных во временной базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--follows', type=int, default=2000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--images', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='очищать кэш перед каждым запросом')
+        parser.add_argument('--output', help='куда сохранить результат (JSON)')
+        parser.add_argument('--compare', help='базовая линия для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='допустимый рост p95, доля')
+
+    def handle(self, *args, **options):
+        dataset = {key: options[key] for key in (
+            'users', 'groups', 'posts', 'follows', 'comments', 'images',
+            'seed'
+        )}
+        media_root = tempfile.mkdtemp(prefix='yatube-benchmark-')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True
+        )
+        try:
+            with override_settings(DEBUG=False, MEDIA_ROOT=media_root,
+                                   TASKS_EAGER=True):
+                synthetic.fill(**dataset)
+                views = benchmark.run(options['repeat'], options['warmup'],
+                                      options['cold_cache'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        result = {
+            'dataset': dataset,
+            'repeat': options['repeat'],
+            'cold_cache': options['cold_cache'],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'views': views,
+        }
+        for name, stats in views.items():
+            self.stdout.write(
+                f"{name:14} p50 {stats['p50_ms']:8.2f}  "
+                f"p95 {stats['p95_ms']:8.2f}  p99 {stats['p99_ms']:8.2f} мс  "
+                f"запросов {stats['queries']:6.2f}  "
+                f"память {stats['peak_kb']:8.1f} КБ"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(result, output, ensure_ascii=False, indent=2)
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                regressions = benchmark.compare(
+                    json.load(baseline)['views'], views, options['threshold']
+                )
+            if regressions:
+                raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from posts import benchmark, synthetic
+from yatube.database import SQLITE_PRAGMAS
+
+MODES = {
+    # Как было: журнал отката, ожидание блокировки только средствами
+    # драйвера.
+    'default': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+    'tuned': SQLITE_PRAGMAS,
+}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает чтение ленты из файла SQLite без нагрузки и во время '
+            'пачек записи со стандартными и настроенными прагмами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=3.0)
+        parser.add_argument('--output', help='куда сохранить результат (JSON)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда проверяет только SQLite.')
+        workdir = tempfile.mkdtemp(prefix='yatube-sqlite-')
+        source = os.path.join(workdir, 'source.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True
+        )
+        try:
+            with override_settings(DEBUG=False, MEDIA_ROOT=workdir,
+                                   TASKS_EAGER=True):
+                synthetic.fill(users=options['users'], groups=10,
+                               posts=options['posts'], follows=0,
+                               comments=options['comments'])
+            connection.ensure_connection()
+            target = sqlite3.connect(source)
+            connection.connection.backup(target)
+            target.close()
+            results = {}
+            for mode, pragmas in MODES.items():
+                for load, writers in (('idle', 0),
+                                      ('burst', options['writers'])):
+                    path = os.path.join(workdir, f'{mode}-{load}.sqlite3')
+                    shutil.copy(source, path)
+                    stats = benchmark.write_burst(
+                        path, pragmas, options['readers'], writers,
+                        options['duration']
+                    )
+                    results[f'{mode}/{load}'] = stats
+                    self.stdout.write(
+                        f"{mode:8} {load:6} "
+                        f"чтений/с {stats['reads_per_s']:9.1f}  "
+                        f"p50 {stats['read_p50_ms']:7.3f}  "
+                        f"p99 {stats['read_p99_ms']:8.3f} мс  "
+                        f"коммитов/с {stats['write_commits_per_s']:7.1f}  "
+                        f"блокировок {stats['locked_errors']}"
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(workdir, ignore_errors=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
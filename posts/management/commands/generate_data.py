@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import synthetic
+
+
+class Command(BaseCommand):
+    help = ('Дополняет базу синтетическими пользователями, группами, '
+            'постами, комментариями и подписками до заданных размеров. '
+            'Прерванную загрузку можно продолжить, запустив команду '
+            'с теми же параметрами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--comments', type=int, default=3000000)
+        parser.add_argument('--follows', type=int, default=200000)
+        parser.add_argument('--images', type=int, default=0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--skew', type=float, default=3.0,
+                            help='перекос распределений, 1 - равномерно')
+        parser.add_argument('--days', type=int, default=365,
+                            help='за сколько дней распределить даты')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='строк в одной транзакции')
+        parser.add_argument('--skip-rebuild', action='store_true',
+                            help='не пересчитывать счётчики, ленты и индекс')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        def log(message):
+            self.stdout.write(
+                f'[{time.monotonic() - started:7.1f} с] {message}'
+            )
+
+        synthetic.fill(
+            users=options['users'], groups=options['groups'],
+            posts=options['posts'], comments=options['comments'],
+            follows=options['follows'], images=options['images'],
+            seed=options['seed'], skew=options['skew'],
+            days=options['days'], batch_size=options['batch_size'],
+            log=log if options['verbosity'] else None,
+            rebuild=not options['skip_rebuild'],
+        )
+        self.stdout.write(self.style.SUCCESS('Данные созданы'))
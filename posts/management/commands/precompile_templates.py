@@ -0,0 +1,15 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from yatube.precompile import precompile_templates
+
+
+class Command(BaseCommand):
+    help = 'Разбирает все шаблоны и сообщает о синтаксических ошибках'
+
+    def handle(self, *args, **options):
+        try:
+            total = precompile_templates()
+        except ImproperlyConfigured as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(f'Шаблонов разобрано: {total}'))
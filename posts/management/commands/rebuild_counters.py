@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import Comment, Post, UserStats, count_subquery
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает с нуля счётчики комментариев, постов и подписок'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            Post.objects.update(
+                comment_count=count_subquery(Comment.objects.all(), 'post')
+            )
+            UserStats.rebuild()
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
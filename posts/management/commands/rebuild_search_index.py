@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = 'Строит поисковый индекс постов заново'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            search.create_fts_table()
+            search.rebuild(Post.objects.all(), Comment.objects.all())
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс построен'))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import digest
+
+
+class Command(BaseCommand):
+    help = ('Отправляет подписчикам дайджесты новых постов с прошлой '
+            'рассылки; запускается по расписанию')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.DIGEST_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        sent = digest.send_digests(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Отправлено писем: {sent}'))
@@ -0,0 +1,79 @@
+import json
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from posts import taskqueue
+
+PRUNE_INTERVAL = 60
+
+
+def work(batch_size, interval, once):
+    """
+    Цикл одного процесса пула: выполняет готовые задачи, а когда
+    их нет - чистит старые и ждёт interval секунд.
+    """
+    # По SIGTERM и Ctrl+C текущая задача дорабатывает до конца.
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stopping.append(True))
+    pruned = 0
+    while not stopping:
+        close_old_connections()
+        batch = taskqueue.claim(batch_size)
+        for number, item in enumerate(batch):
+            if stopping:
+                taskqueue.release(batch[number:])
+                break
+            taskqueue.run(item)
+        if batch:
+            continue
+        if time.monotonic() - pruned > PRUNE_INTERVAL:
+            taskqueue.prune()
+            pruned = time.monotonic()
+        if once:
+            break
+        time.sleep(interval)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи пулом процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=settings.TASK_WORKERS)
+        parser.add_argument('--batch-size', type=int,
+                            default=taskqueue.BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='пауза, когда очередь пуста, секунды')
+        parser.add_argument('--once', action='store_true',
+                            help='выполнить готовые задачи и выйти')
+        parser.add_argument('--stats', action='store_true',
+                            help='вывести сводку по очереди и выйти')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(taskqueue.stats(), indent=2,
+                                         ensure_ascii=False))
+            return
+        params = (options['batch_size'], options['interval'],
+                  options['once'])
+        if options['processes'] <= 1:
+            work(*params)
+            return
+        # Дочерние процессы не должны унаследовать открытые соединения.
+        connections.close_all()
+        pool = [multiprocessing.Process(target=work, args=params)
+                for _ in range(options['processes'])]
+        for process in pool:
+            process.start()
+        signal.signal(signal.SIGTERM,
+                      lambda *args: [p.terminate() for p in pool])
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in pool:
+            process.join()
@@ -0,0 +1,62 @@
+# Generated by Django 2.2.20 on 2026-10-18 02:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def remove_duplicate_follows(apps, schema_editor):
+    # Перед уникальным индексом по (user, author) остаётся первая
+    # подписка из каждой группы повторов.
+    Follow = apps.get_model('posts', 'Follow')
+    first = Follow.objects.values('user', 'author').annotate(
+        first=models.Min('pk')
+    ).values('first')
+    Follow.objects.exclude(pk__in=first).delete()
+
+
+def fill_counters(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    UserStats = apps.get_model('posts', 'UserStats')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    for post in Post.objects.annotate(total=models.Count('comments')):
+        Post.objects.filter(pk=post.pk).update(comment_count=post.total)
+    for user in User.objects.all():
+        UserStats.objects.update_or_create(user_id=user.pk, defaults={
+            'posts_count': user.posts.count(),
+            'following_count': user.following.count(),
+            'follower_count': user.follower.count(),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_auto_20200822_1029'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Постов')),
+                ('following_count', models.PositiveIntegerField(default=0, verbose_name='Подписчиков')),
+                ('follower_count', models.PositiveIntegerField(default=0, verbose_name='Подписан')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев'),
+        ),
+        migrations.RunPython(remove_duplicate_follows,
+                             migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='follow',
+            unique_together={('user', 'author')},
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
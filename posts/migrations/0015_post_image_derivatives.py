@@ -0,0 +1,18 @@
+# Generated by Django 2.2.20 on 2026-10-18 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_derivatives',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Уменьшенные копии изображения'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.20 on 2026-10-18 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppliedWrite',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('applied', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
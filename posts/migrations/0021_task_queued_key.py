@@ -0,0 +1,17 @@
+# Generated by Django 2.2.20 on 2026-10-18 03:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_digest_runs'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(condition=models.Q(('attempts', 0), ('status', 'queued'), models.Q(_negated=True, key='')), fields=('key',), name='task_queued_key_unique'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.20 on 2026-10-18 03:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_task_queued_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digestrun',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='digestrun',
+            name='previous',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='next_run', to='posts.DigestRun'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def fill_search_index(apps, schema_editor):
+    # Индекс постов, созданных до появления поиска: дальше его
+    # поддерживают задачи из сигналов.
+    from posts import search
+
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    if not Post.objects.exists():
+        return
+    if settings.SEARCH_BACKEND != 'python' and search.fts5_available():
+        backend = search.Fts5Backend()
+    else:
+        backend = search.PythonBackend(apps.get_model('posts',
+                                                      'SearchPosting'))
+    search.rebuild(Post.objects.all(), Comment.objects.all(), backend)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_digest_run_lock'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
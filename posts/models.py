@@ -1,9 +1,46 @@
+import json
+
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.db import models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from yatube.database import write_atomic
 
 User = get_user_model()
 
 
+def count_subquery(queryset, field):
+    """
+    Коррелированный подзапрос COUNT для аннотации: считается только
+    для строк, попавших в выборку, и не требует GROUP BY.
+    """
+    counted = (
+        queryset.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+class AtomicSaveModel(models.Model):
+    """
+    Сохраняет строку в одной транзакции с обработчиками post_save
+    (счётчики, ленты, задачи): иначе сбой обработчика оставил бы
+    строку без них. Удаление Django и так выполняет в транзакции
+    вместе с post_delete.
+    """
+    def save(self, *args, **kwargs):
+        with write_atomic(kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
 class Group(models.Model):
     title = models.CharField(
         max_length=200, unique=True, null=False, blank=False
@@ -15,7 +52,15 @@ class Group(models.Model):
         return self.title
 
 
-class Post(models.Model):
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """
+        Всё, что нужно includes/post_item.html, одним запросом.
+        """
+        return self.select_related('author', 'group')
+
+
+class Post(AtomicSaveModel):
     text = models.TextField(verbose_name='Текст')
     pub_date = models.DateTimeField(
         verbose_name='Дата публикации', auto_now_add=True,
@@ -33,24 +78,228 @@ class Post(models.Model):
         verbose_name='Группа'
     )
     image = models.ImageField(upload_to='posts/', blank=True, null=True, verbose_name='Изображение')
+    comment_count = models.PositiveIntegerField(
+        verbose_name='Комментариев', default=0, editable=False
+    )
+    version = models.PositiveIntegerField(
+        verbose_name='Версия карточки', default=0, editable=False
+    )
+    image_derivatives = models.TextField(
+        verbose_name='Уменьшенные копии изображения', blank=True,
+        default='', editable=False
+    )
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.author}:{self.text[:10]}:{self.pub_date.strftime("%d/%m/%Y")}'
 
+    @property
+    def image_sources(self):
+        """
+        Источники для <picture>: тип и srcset по каждому формату
+        из image_derivatives.
+        """
+        if not self.image_derivatives:
+            return []
+        return [
+            {'type': f'image/{fmt.lower()}',
+             'srcset': ', '.join(f'{default_storage.url(name)} {width}w'
+                                 for width, name in files)}
+            for fmt, files in json.loads(self.image_derivatives).items()
+        ]
+
     class Meta():
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_date_idx'),
+        ]
 
 
-class Comment(models.Model):
+class Comment(AtomicSaveModel):
     post = models.ForeignKey(Post, null=True, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta():
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
+
 
-class Follow(models.Model):
+class Follow(AtomicSaveModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='follower')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
 
     class Meta():
         unique_together = ('user', 'author')
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """
+    Счётчики пользователя для карточки автора. Поддерживаются
+    сигналами из posts/signals.py, пересчитываются командой
+    rebuild_counters.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        related_name='stats'
+    )
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Постов', default=0
+    )
+    following_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков', default=0
+    )
+    follower_count = models.PositiveIntegerField(
+        verbose_name='Подписан', default=0
+    )
+
+    def __str__(self):
+        return f'{self.user}:{self.posts_count}:{self.following_count}:{self.follower_count}'
+
+    @classmethod
+    def rebuild(cls, users=None):
+        """
+        Пересчитывает счётчики с нуля для users (по умолчанию - для всех).
+        """
+        users = User.objects.all() if users is None else users
+        cls.objects.bulk_create(
+            [cls(user_id=pk) for pk in users.filter(
+                stats__isnull=True
+            ).values_list('pk', flat=True).iterator()],
+            ignore_conflicts=True,
+        )
+        # Одним UPDATE с коррелированными подзапросами: pk строки
+        # счётчиков совпадает с id пользователя.
+        cls.objects.filter(user__in=users.values('pk')).update(
+            posts_count=count_subquery(Post.objects.all(), 'author'),
+            following_count=count_subquery(Follow.objects.all(), 'author'),
+            follower_count=count_subquery(Follow.objects.all(), 'user'),
+        )
+
+
+class TimelineEntry(models.Model):
+    """
+    Материализованная лента подписок: запись появляется у каждого
+    подписчика при публикации поста (fan-out-on-write).
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name='timeline'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta():
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', 'pub_date', 'post'],
+                         name='timeline_user_date_idx'),
+        ]
+
+
+class SearchPosting(models.Model):
+    """
+    Запись обратного индекса для поиска без FTS5 (см. posts.search):
+    основа слова и её взвешенная частота в посте.
+    """
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name='search_postings'
+    )
+    weight = models.FloatField()
+
+    class Meta():
+        unique_together = ('term', 'post')
+
+
+class AppliedWrite(models.Model):
+    """
+    Ключ операции из журнала отложенной записи (posts.writequeue),
+    которая уже применена. Не даёт применить её второй раз.
+    """
+    key = models.CharField(max_length=100, unique=True)
+    applied = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class Task(models.Model):
+    """
+    Фоновая задача (см. posts.taskqueue).
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'В очереди'), (RUNNING, 'Выполняется'),
+                (DONE, 'Выполнена'), (FAILED, 'Не выполнена')]
+
+    name = models.CharField(max_length=100)
+    args = models.TextField(default='[]')
+    # Пока задача с непустым ключом ждёт первого запуска, такая же
+    # повторно не ставится.
+    key = models.CharField(max_length=200, blank=True, default='',
+                           db_index=True)
+    status = models.CharField(max_length=10, choices=STATUSES,
+                              default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=32, blank=True, default='')
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.FloatField(null=True, blank=True)
+
+    class Meta():
+        indexes = [
+            models.Index(fields=['status', 'run_at'],
+                         name='task_status_run_at_idx'),
+        ]
+        constraints = [
+            # Повторы (attempts > 0) под ограничение не попадают:
+            # рядом с ними может ждать новая задача с тем же ключом.
+            models.UniqueConstraint(
+                fields=['key'], name='task_queued_key_unique',
+                condition=models.Q(status='queued', attempts=0)
+                & ~models.Q(key=''),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name}:{self.status}:{self.attempts}'
+
+
+class DigestRun(models.Model):
+    """
+    Рассылка дайджеста (см. posts.digest): посты с id в интервале
+    (first_post_id, last_post_id] и подписчики, которым письма уже
+    отправлены, - до last_user_id включительно.
+    """
+    # У рассылки не больше одной следующей: две команды, запущенные
+    # одновременно, не создадут две рассылки одних и тех же постов.
+    previous = models.OneToOneField(
+        'self', on_delete=models.CASCADE, null=True, blank=True,
+        related_name='next_run'
+    )
+    first_post_id = models.PositiveIntegerField()
+    last_post_id = models.PositiveIntegerField()
+    last_user_id = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    # До этого времени рассылку ведёт захватившая её команда.
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.first_post_id}-{self.last_post_id}:{self.sent}'
@@ -0,0 +1,175 @@
+import hashlib
+import time
+import uuid
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.views.decorators.http import condition
+
+from yatube.routers import read_primary
+
+from .models import Group
+
+SCOPE_KEY = 'page_scope:{}'
+SITE_SCOPE = 'site'
+
+
+def _new_version(previous=None):
+    """
+    Версия области: время сброса и случайная строка. Случайная часть,
+    а не счётчик: если ключ вытеснен из кэша, новая версия не совпадёт
+    со старой и устаревшие страницы не «воскреснут». Время нужно для
+    заголовка Last-Modified и строго растёт: сброс в ту же секунду,
+    что и прошлый, получает следующую секунду, иначе клиент
+    с If-Modified-Since получил бы 304 на изменившуюся страницу.
+    """
+    stamp = int(time.time())
+    if previous is not None:
+        stamp = max(stamp, _modified_at(previous) + 1)
+    return f'{stamp}-{uuid.uuid4().hex}'
+
+
+def _scope_versions(scopes):
+    """
+    Текущие версии областей кэша.
+    """
+    keys = [SCOPE_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), settings.PAGE_CACHE_TIMEOUT)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _modified_at(version):
+    stamp, _, _ = version.partition('-')
+    try:
+        return int(stamp)
+    except ValueError:
+        # Версия старого формата без времени - считаем её свежей.
+        return int(time.time())
+
+
+def purge_pages(*scopes):
+    """
+    Сбрасывает закэшированные страницы указанных областей.
+
+    Области сбрасывают сигналы моделей. Записи мимо них - update()
+    и delete() у QuerySet, bulk_create, сырой SQL - должны вызвать
+    purge_pages() сами, иначе страницы и их валидаторы обновятся
+    только через PAGE_CACHE_TIMEOUT, когда истечёт версия области.
+    """
+    keys = [SCOPE_KEY.format(scope) for scope in scopes]
+    previous = cache.get_many(keys)
+    cache.set_many(
+        {key: _new_version(previous.get(key)) for key in keys},
+        settings.PAGE_CACHE_TIMEOUT
+    )
+
+
+def purge(*scopes):
+    """
+    Сбрасывает страницы сразу и ещё раз после коммита: иначе анонимный
+    запрос между сбросом и коммитом закэширует старые данные.
+    """
+    purge_pages(*scopes)
+    transaction.on_commit(lambda: purge_pages(*scopes))
+
+
+def purge_post_pages(post, group_ids=()):
+    group_ids = {post.group_id, *group_ids} - {None}
+    slugs = Group.objects.filter(pk__in=group_ids).values_list('slug', flat=True)
+    purge('index', f'profile:{post.author.username}', f'post:{post.pk}',
+          *(f'group:{slug}' for slug in slugs))
+
+
+def _page_key(request, scopes):
+    versions = ':'.join(_scope_versions(scopes))
+    raw = f'{versions}:{request.get_full_path()}'
+    return 'page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def _is_cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+    )
+
+
+def cache_anonymous_page(*scopes, timeout=None):
+    """
+    Кэширует страницу для анонимных GET-запросов.
+
+    scopes - шаблоны областей вида 'group:{slug}', подставляются
+    аргументы view. Страница сбрасывается purge_pages() любой из своих
+    областей, а также области 'site'. Ответы для авторизованных
+    пользователей и страницы с CSRF-токеном не кэшируются. Страница
+    для кэша собирается по основной базе, не по реплике.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            key = _page_key(request, [SITE_SCOPE] + [
+                scope.format(**kwargs) for scope in scopes
+            ])
+            response = cache.get(key)
+            if response is None:
+                with read_primary():
+                    response = view(request, *args, **kwargs)
+                if _is_cacheable(request, response):
+                    cache.set(
+                        key, response, timeout or settings.PAGE_CACHE_TIMEOUT
+                    )
+            return response
+        return wrapper
+    return decorator
+
+
+def _validators(request, scopes, kwargs):
+    """
+    ETag и Last-Modified страницы по версиям её областей - без
+    запросов к базе. Вычисляются один раз на запрос: condition()
+    спрашивает их по отдельности.
+    """
+    if not hasattr(request, '_page_validators'):
+        versions = _scope_versions([SITE_SCOPE] + [
+            scope.format(**kwargs) for scope in scopes
+        ])
+        # Страница авторизованного пользователя зависит от него самого
+        # и от CSRF-токена в формах.
+        viewer = (request.user.pk, request.COOKIES.get(
+            settings.CSRF_COOKIE_NAME
+        )) if request.user.is_authenticated else None
+        raw = f'{":".join(versions)}:{viewer}:{request.get_full_path()}'
+        # Last-Modified не зависит от пользователя: после смены
+        # аккаунта If-Modified-Since отдал бы 304 с чужой страницей.
+        request._page_validators = (
+            hashlib.md5(raw.encode()).hexdigest(),
+            None if viewer else datetime.utcfromtimestamp(
+                max(map(_modified_at, versions))
+            ),
+        )
+    return request._page_validators
+
+
+def conditional_page(*scopes):
+    """
+    Условный GET по областям кэша: отдаёт ETag и Last-Modified и
+    отвечает 304 на If-None-Match / If-Modified-Since, пока ни одна
+    из областей не сброшена, - не выполняя view. Авторизованным
+    пользователям - только ETag.
+    """
+    def etag(request, *args, **kwargs):
+        return _validators(request, scopes, kwargs)[0]
+
+    def last_modified(request, *args, **kwargs):
+        return _validators(request, scopes, kwargs)[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,173 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 50
+
+
+def encode_cursor(pub_date, pk):
+    """
+    Упаковывает позицию записи (дата публикации, id) в строку для URL.
+    """
+    raw = f'{pub_date.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Распаковывает курсор, возвращает None для испорченного значения.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        pub_date, pk = raw.decode().split('|')
+        return datetime.fromisoformat(pub_date), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    """
+    Страница keyset-паджинатора: записи и курсоры соседних страниц.
+    """
+
+    def __init__(self, object_list, has_next, has_previous,
+                 date_field='pub_date'):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.date_field = date_field
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def _cursor(self, obj):
+        return encode_cursor(getattr(obj, self.date_field), obj.pk)
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self._cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self._cursor(self.object_list[0])
+        return None
+
+
+class KeysetPaginator:
+    """
+    Паджинатор по ключу (pub_date, id) от новых записей к старым.
+    Не выполняет COUNT(*) и не использует OFFSET: каждая страница -
+    один запрос по индексу pub_date.
+
+    lookups задаёт поля ключа для фильтра и сортировки, если они
+    отличаются от (date_field, pk), как в TimelineEntry.
+    """
+
+    def __init__(self, object_list, per_page, date_field='pub_date',
+                 lookups=None):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.date_field = date_field
+        self.lookups = lookups or (date_field, 'pk')
+
+    def page(self, after=None, before=None):
+        date_lookup, pk_lookup = self.lookups
+        queryset = self.object_list
+        if after is not None:
+            pub_date, pk = after
+            queryset = queryset.filter(
+                Q(**{f'{date_lookup}__lt': pub_date})
+                | Q(**{date_lookup: pub_date, f'{pk_lookup}__lt': pk})
+            )
+        elif before is not None:
+            pub_date, pk = before
+            queryset = queryset.filter(
+                Q(**{f'{date_lookup}__gt': pub_date})
+                | Q(**{date_lookup: pub_date, f'{pk_lookup}__gt': pk})
+            )
+            rows = list(
+                queryset.order_by(date_lookup, pk_lookup)[:self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            return KeysetPage(rows, True, has_previous, self.date_field)
+        rows = list(
+            queryset.order_by(f'-{date_lookup}', f'-{pk_lookup}')
+            [:self.per_page + 1]
+        )
+        has_next = len(rows) > self.per_page
+        return KeysetPage(
+            rows[:self.per_page], has_next, after is not None,
+            self.date_field
+        )
+
+
+def comment_batch(comments, after=None, per_page=None):
+    """
+    Порция комментариев от старых к новым после курсора after по ключу
+    (created, id) и курсор следующей порции или None.
+
+    Порция остаётся QuerySet (уже выполненным), авторы подгружаются
+    тем же запросом. Есть ли продолжение, проверяется отдельным EXISTS
+    только для полной порции.
+    """
+    per_page = per_page or COMMENTS_PER_PAGE
+    comments = comments.select_related('author').order_by('created', 'id')
+    if after is not None:
+        created, pk = after
+        comments = comments.filter(
+            Q(created__gt=created) | Q(created=created, pk__gt=pk)
+        )
+    batch = comments[:per_page]
+    rows = list(batch)
+    if len(rows) < per_page:
+        return batch, None
+    last = rows[-1]
+    has_next = comments.filter(
+        Q(created__gt=last.created) | Q(created=last.created, pk__gt=last.pk)
+    ).exists()
+    return batch, encode_cursor(last.created, last.pk) if has_next else None
+
+
+def paginate(request, object_list, per_page=POSTS_PER_PAGE, keyset=None):
+    """
+    Возвращает контекст страницы ленты: page, paginator и cursor.
+
+    По умолчанию и для ?after=/?before= работает keyset-паджинатор.
+    Старые ссылки вида ?page=N обслуживаются обычным Paginator.
+    Объект paginator в контексте ленивый: COUNT(*) выполнится,
+    только если шаблон обратится к числу страниц.
+    keyset позволяет подменить источник страниц (см. posts.timeline).
+    """
+    paginator = Paginator(object_list, per_page)
+    page_number = request.GET.get('page')
+    if page_number is not None:
+        return {'page': paginator.get_page(page_number),
+                'paginator': paginator, 'cursor': None}
+    if keyset is None:
+        keyset = KeysetPaginator(object_list, per_page)
+    cursor = keyset.page(
+        after=decode_cursor(request.GET.get('after')),
+        before=decode_cursor(request.GET.get('before')),
+    )
+    page = Page(cursor.object_list, 1, paginator)
+    return {'page': page, 'paginator': paginator, 'cursor': cursor}
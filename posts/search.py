@@ -0,0 +1,368 @@
+"""
+Полнотекстовый поиск по постам.
+
+Документ индекса - пост: его текст, тексты комментариев и название
+группы. Слова приводятся к основе стеммером (posts.stemmer), поэтому
+поиск не зависит от падежа и числа. Индекс обновляется задачами
+(posts.taskqueue), которые сигналы ставят при сохранении и удалении
+постов, комментариев и групп. Новый комментарий дописывается
+в документ поста, остальные изменения пересчитывают документ целиком.
+
+Если SQLite собран с FTS5, индекс - виртуальная таблица posts_search,
+ранжирование - bm25. Иначе (или при SEARCH_BACKEND = 'python') индекс
+хранится в SearchPosting, а та же оценка считается запросом с GROUP BY.
+Результаты упорядочены по релевантности, постранично с курсором.
+"""
+import base64
+import binascii
+import math
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.core.cache import cache
+from django.db.models import (Case, Count, F, FloatField, Q, Sum, Value,
+                              When)
+
+from .models import Comment, Post, SearchPosting
+from .paginator import POSTS_PER_PAGE
+from .stemmer import stem
+from .taskqueue import is_queued, task
+
+FTS_TABLE = 'posts_search'
+# Вес совпадения в тексте поста, комментариях и названии группы.
+WEIGHTS = (1.0, 0.5, 0.5)
+# Насыщение частоты слова в BM25.
+K1 = 1.2
+# Не больше 999 параметров на запрос в старых SQLite.
+BATCH_SIZE = 200
+
+WORD_RE = re.compile(r'\w+')
+# Число документов для IDF меняется медленно и пересчитывается
+# не чаще раза в столько секунд.
+DOCUMENTS_KEY = 'search:documents'
+DOCUMENTS_TIMEOUT = 5 * 60
+
+# Есть ли таблица FTS5 - по имени базы.
+_fts5 = {}
+
+
+def tokenize(text):
+    """
+    Основы слов текста в нижнем регистре.
+    """
+    return [stem(word) for word in WORD_RE.findall(text.lower())]
+
+
+def encode_cursor(score, pk):
+    raw = f'{score!r}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        score, pk = raw.decode().split('|')
+        return float(score), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def fts5_available():
+    """
+    Есть ли в базе таблица FTS5. Ответ запоминается на время жизни
+    процесса: таблица появляется только миграцией или
+    create_fts_table().
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts5:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE type = 'table' AND name = %s", [FTS_TABLE]
+            )
+            _fts5[name] = cursor.fetchone() is not None
+    return _fts5[name]
+
+
+def create_fts_table():
+    """
+    Создаёт таблицу FTS5, если SQLite её поддерживает. Возвращает,
+    удалось ли это.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                'USING fts5(text, comments, grp)'
+            )
+    except DatabaseError:
+        return False
+    _fts5[connection.settings_dict['NAME']] = True
+    return True
+
+
+def documents(posts, comments):
+    """
+    Документы индекса: (id поста, основы текста, комментариев,
+    названия группы). posts и comments - менеджеры или queryset'ы
+    моделей Post и Comment, в том числе исторических из миграций.
+    """
+    rows = list(posts.values_list('pk', 'text', 'group__title'))
+    comment_words = defaultdict(list)
+    for post_id, text in comments.filter(
+        post_id__in=[row[0] for row in rows]
+    ).order_by().values_list('post_id', 'text'):
+        comment_words[post_id] += tokenize(text)
+    return [
+        (pk, tokenize(text), comment_words[pk], tokenize(title or ''))
+        for pk, text, title in rows
+    ]
+
+
+class Fts5Backend:
+    QUERY = (
+        f'SELECT rowid, score FROM ('
+        f'SELECT rowid, bm25({FTS_TABLE}, %s, %s, %s) AS score '
+        f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s) '
+        f'WHERE score > %s OR (score = %s AND rowid > %s) '
+        f'ORDER BY score, rowid LIMIT %s'
+    )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def remove(self, post_ids):
+        post_ids = list(post_ids)
+        if not post_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({{}})'.format(
+                    ', '.join(['%s'] * len(post_ids))
+                ), post_ids
+            )
+
+    def write(self, docs):
+        self.remove([doc[0] for doc in docs])
+        if not docs:
+            return
+        params = []
+        for pk, *columns in docs:
+            params += [pk, *(' '.join(words) for words in columns)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, text, comments, grp) '
+                'VALUES ' + ', '.join(['(%s, %s, %s, %s)'] * len(docs)),
+                params
+            )
+
+    def append_comment(self, post_id, words):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {FTS_TABLE} SET comments = comments || ' ' || %s "
+                'WHERE rowid = %s', [' '.join(words), post_id]
+            )
+            return cursor.rowcount > 0
+
+    def search(self, terms, after, limit):
+        match = ' '.join('"{}"'.format(term.replace('"', '""'))
+                         for term in terms)
+        score, pk = after or (-math.inf, 0)
+        with connection.cursor() as cursor:
+            cursor.execute(self.QUERY, [*WEIGHTS, match, score, score, pk,
+                                        limit])
+            return cursor.fetchall()
+
+
+class PythonBackend:
+    """
+    Обратный индекс в таблице SearchPosting: для каждой основы
+    и поста - взвешенная частота. Ранжирование - BM25 без нормировки
+    по длине документа.
+    """
+
+    def __init__(self, posting_model=SearchPosting):
+        self.model = posting_model
+
+    def clear(self):
+        self.model.objects.all().delete()
+
+    def remove(self, post_ids):
+        self.model.objects.filter(post_id__in=post_ids).delete()
+
+    def write(self, docs):
+        self.remove([doc[0] for doc in docs])
+        postings = []
+        for pk, *columns in docs:
+            weights = defaultdict(float)
+            for weight, words in zip(WEIGHTS, columns):
+                for word in words:
+                    weights[word] += weight
+            postings += [
+                self.model(term=term[:64], post_id=pk, weight=value)
+                for term, value in weights.items()
+            ]
+        self.model.objects.bulk_create(postings, batch_size=BATCH_SIZE)
+
+    def append_comment(self, post_id, words):
+        postings = self.model.objects.filter(post_id=post_id)
+        if not postings.exists():
+            return False
+        weights = defaultdict(float)
+        for word in words:
+            weights[word[:64]] += WEIGHTS[1]
+        existing = set(postings.filter(term__in=weights).values_list(
+            'term', flat=True
+        ))
+        for term in existing:
+            postings.filter(term=term).update(
+                weight=F('weight') + weights[term]
+            )
+        self.model.objects.bulk_create([
+            self.model(term=term, post_id=post_id, weight=weight)
+            for term, weight in weights.items() if term not in existing
+        ], batch_size=BATCH_SIZE)
+        return True
+
+    def documents(self):
+        return cache.get_or_set(
+            DOCUMENTS_KEY,
+            lambda: self.model.objects.values('post_id').distinct().count(),
+            DOCUMENTS_TIMEOUT
+        )
+
+    def search(self, terms, after, limit):
+        """
+        Отбор постов со всеми словами и оценка - в SQL; в Python
+        только IDF по числу постов с каждым словом.
+        """
+        terms = sorted({term[:64] for term in terms})
+        postings = self.model.objects.filter(term__in=terms)
+        frequency = dict(postings.order_by().values_list('term').annotate(
+            count=Count('pk')
+        ))
+        if len(frequency) < len(terms):
+            return []
+        # Закэшированное число документов могло отстать от индекса.
+        total = max(self.documents(), *frequency.values())
+        idf = Case(*[
+            When(term=term, then=Value(
+                math.log(1 + (total - count + 0.5) / (count + 0.5))
+            )) for term, count in frequency.items()
+        ], output_field=FloatField())
+        hits = postings.order_by().values('post_id').annotate(
+            matched=Count('pk'),
+            score=-Sum(idf * F('weight') * (K1 + 1) / (F('weight') + K1)),
+        ).filter(matched=len(terms))
+        if after is not None:
+            score, pk = after
+            hits = hits.filter(Q(score__gt=score)
+                               | Q(score=score, post_id__gt=pk))
+        return list(hits.order_by('score', 'post_id').values_list(
+            'post_id', 'score'
+        )[:limit])
+
+
+def get_backend():
+    if settings.SEARCH_BACKEND != 'python' and fts5_available():
+        return Fts5Backend()
+    return PythonBackend()
+
+
+@task()
+def index_posts(post_ids):
+    """
+    Пересчитывает документы индекса для постов post_ids. Посты,
+    которых уже нет, удаляются из индекса.
+    """
+    post_ids = list(post_ids)
+    backend = get_backend()
+    for start in range(0, len(post_ids), BATCH_SIZE):
+        batch = post_ids[start:start + BATCH_SIZE]
+        docs = documents(Post.objects.filter(pk__in=batch), Comment.objects)
+        backend.remove(set(batch) - {doc[0] for doc in docs})
+        backend.write(docs)
+
+
+@task()
+def index_comment(comment_id):
+    """
+    Дописывает основы нового комментария в документ его поста,
+    не перечитывая остальные комментарии. Если полная переиндексация
+    поста уже ждёт в очереди, она учтёт и этот комментарий.
+    """
+    row = Comment.objects.filter(pk=comment_id).values_list(
+        'post_id', 'text'
+    ).first()
+    if row is None:
+        return
+    post_id, text = row
+    if is_queued(f'search:{post_id}'):
+        return
+    if not get_backend().append_comment(post_id, tokenize(text)):
+        index_posts([post_id])
+
+
+def remove_posts(post_ids):
+    get_backend().remove(list(post_ids))
+
+
+def rebuild(posts, comments, backend=None):
+    """
+    Строит индекс заново для всех постов из posts.
+    """
+    backend = backend or get_backend()
+    backend.clear()
+    ids = list(posts.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), BATCH_SIZE):
+        backend.write(documents(
+            posts.filter(pk__in=ids[start:start + BATCH_SIZE]), comments
+        ))
+
+
+class SearchPage:
+    """
+    Страница результатов поиска и курсор следующей.
+    """
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def search(query, after=None, per_page=POSTS_PER_PAGE):
+    """
+    Посты, содержащие все слова запроса, от самых релевантных.
+    after - курсор из SearchPage.next_cursor предыдущей страницы.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return SearchPage([], None)
+    hits = get_backend().search(terms, decode_cursor(after), per_page + 1)
+    posts = Post.objects.for_feed().in_bulk([pk for pk, score in hits[:per_page]])
+    next_cursor = None
+    if len(hits) > per_page:
+        pk, score = hits[per_page - 1]
+        next_cursor = encode_cursor(score, pk)
+    return SearchPage(
+        [posts[pk] for pk, score in hits[:per_page] if pk in posts],
+        next_cursor
+    )
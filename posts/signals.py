@@ -0,0 +1,176 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import search, thumbnails, timeline
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .page_cache import SITE_SCOPE, purge, purge_post_pages
+
+
+def change_stats(user_id, **deltas):
+    """
+    Атомарно сдвигает счётчики пользователя на deltas.
+    Если строки счётчиков ещё нет - при увеличении пересчитывает её
+    с нуля, при уменьшении ничего не делает: пользователь может
+    удаляться каскадом вместе со своей строкой.
+    """
+    with transaction.atomic():
+        updated = UserStats.objects.filter(user_id=user_id).update(
+            **{field: F(field) + delta for field, delta in deltas.items()}
+        )
+        if not updated and min(deltas.values()) > 0:
+            UserStats.rebuild(User.objects.filter(pk=user_id))
+
+
+def forget_derivatives(image_name, derivatives):
+    """
+    После коммита удаляет адаптивные копии изображения, которое
+    больше не использует ни один пост.
+    """
+    if not derivatives or Post.objects.filter(image=image_name).exists():
+        return
+    transaction.on_commit(lambda: thumbnails.delete_derivatives(derivatives))
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def remember_saved_state(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        (instance._saved_group_id, instance._saved_image,
+         instance._saved_derivatives) = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', 'image', 'image_derivatives').first() or (
+            None, None, ''
+        )
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        change_stats(instance.author_id, posts_count=1)
+        timeline.fan_out_post.delay(instance.pk)
+    else:
+        timeline.touch(instance)
+        Post.objects.filter(pk=instance.pk).update(version=F('version') + 1)
+    if instance.image.name != getattr(instance, '_saved_image', None):
+        if not created:
+            Post.objects.filter(pk=instance.pk).update(image_derivatives='')
+            forget_derivatives(getattr(instance, '_saved_image', None),
+                               getattr(instance, '_saved_derivatives', ''))
+        thumbnails.schedule(instance)
+    purge_post_pages(instance, [getattr(instance, '_saved_group_id', None)])
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    change_stats(instance.author_id, posts_count=-1)
+    forget_derivatives(instance.image.name, instance.image_derivatives)
+    purge_post_pages(instance)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        instance.posts.update(version=F('version') + 1)
+        purge(SITE_SCOPE)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    instance.posts.update(version=F('version') + 1)
+    purge(SITE_SCOPE)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.post_id is not None:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') + 1, version=F('version') + 1
+        )
+        purge_post_pages(instance.post)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') - 1, version=F('version') + 1
+        )
+        post = Post.objects.filter(pk=instance.post_id).first()
+        if post is not None:
+            purge_post_pages(post)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        with transaction.atomic():
+            change_stats(instance.author_id, following_count=1)
+            change_stats(instance.user_id, follower_count=1)
+            timeline.followers_changed(instance.author_id, 1)
+            timeline.backfill(instance.user_id, instance.author_id)
+        timeline.forget_heavy_authors(instance.user_id)
+        purge(f'profile:{instance.author.username}',
+              f'profile:{instance.user.username}')
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    with transaction.atomic():
+        change_stats(instance.author_id, following_count=-1)
+        change_stats(instance.user_id, follower_count=-1)
+        timeline.prune(instance.user_id, instance.author_id)
+        timeline.followers_changed(instance.author_id, -1)
+    timeline.forget_heavy_authors(instance.user_id)
+    purge(f'profile:{instance.author.username}',
+          f'profile:{instance.user.username}')
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_posts.delay([instance.pk], key=f'search:{instance.pk}')
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove_posts([instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def index_comment(sender, instance, created=False, raw=False, **kwargs):
+    if raw or instance.post_id is None:
+        return
+    if created:
+        search.index_comment.delay(instance.pk)
+    else:
+        search.index_posts.delay([instance.post_id],
+                                 key=f'search:{instance.post_id}')
+
+
+@receiver(post_save, sender=Group)
+def index_group(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.index_posts.delay(
+            list(instance.posts.values_list('pk', flat=True))
+        )
+
+
+@receiver(pre_delete, sender=Group)
+def remember_group_posts(sender, instance, **kwargs):
+    instance._post_ids = list(instance.posts.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def unindex_group(sender, instance, **kwargs):
+    search.index_posts.delay(getattr(instance, '_post_ids', []))
@@ -0,0 +1,133 @@
+"""
+Стеммер русского языка по алгоритму Snowball (Портера).
+Используется поисковым индексом, чтобы «пост», «посты» и «постами»
+находились одним запросом.
+"""
+from functools import lru_cache
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (
+    ('в', 'вши', 'вшись'),
+    ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'),
+)
+REFLEXIVE = ('ся', 'сь')
+ADJECTIVE = (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им',
+    'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая',
+    'яя', 'ою', 'ею',
+)
+PARTICIPLE = (
+    ('ем', 'нн', 'вш', 'ющ', 'щ'),
+    ('ивш', 'ывш', 'ующ'),
+)
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет',
+     'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй',
+     'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют',
+     'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и',
+    'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о',
+    'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+SUPERLATIVE = ('ейш', 'ейше')
+DERIVATIONAL = ('ост', 'ость')
+
+
+def _region(word, start=0):
+    """
+    Начало области после первого сочетания «гласная + согласная».
+    """
+    for index in range(start + 1, len(word)):
+        if word[index] not in VOWELS and word[index - 1] in VOWELS:
+            return index + 1
+    return len(word)
+
+
+@lru_cache(maxsize=None)
+def _suffix_set(suffixes):
+    return frozenset(suffixes), max(map(len, suffixes))
+
+
+def _longest(word, suffixes):
+    known, longest = _suffix_set(suffixes)
+    for length in range(min(longest, len(word)), 0, -1):
+        if word[-length:] in known:
+            return word[-length:]
+    return None
+
+
+def _strip(word, groups):
+    """
+    Отрезает самое длинное окончание. groups - пара: окончания,
+    которые должны стоять после «а» или «я», и все остальные.
+    Возвращает слово без окончания или None.
+    """
+    preceded, free = groups
+    suffix = _longest(word, preceded + free)
+    if suffix is None:
+        return None
+    rest = word[:-len(suffix)]
+    if suffix in free:
+        return rest
+    if rest.endswith(('а', 'я')):
+        return rest
+    return None
+
+
+def _strip_adjectival(word):
+    suffix = _longest(word, ADJECTIVE)
+    if suffix is None:
+        return None
+    word = word[:-len(suffix)]
+    return _strip(word, PARTICIPLE) or word
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """
+    Основа русского слова в нижнем регистре.
+    """
+    word = word.replace('ё', 'е')
+    for index, letter in enumerate(word):
+        if letter in VOWELS:
+            break
+    else:
+        return word
+    prefix, rv = word[:index + 1], word[index + 1:]
+    r2 = max(_region(word, _region(word)) - len(prefix), 0)
+
+    stripped = _strip(rv, PERFECTIVE_GERUND)
+    if stripped is None:
+        suffix = _longest(rv, REFLEXIVE)
+        if suffix:
+            rv = rv[:-len(suffix)]
+        stripped = _strip_adjectival(rv)
+        if stripped is None:
+            stripped = _strip(rv, VERB)
+        if stripped is None:
+            suffix = _longest(rv, NOUN)
+            stripped = rv[:-len(suffix)] if suffix else rv
+    rv = stripped
+
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    suffix = _longest(rv[r2:], DERIVATIONAL)
+    if suffix:
+        rv = rv[:-len(suffix)]
+
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        suffix = _longest(rv, SUPERLATIVE)
+        if suffix:
+            rv = rv[:-len(suffix)]
+            if rv.endswith('нн'):
+                rv = rv[:-1]
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
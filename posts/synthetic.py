@@ -0,0 +1,268 @@
+"""
+Синтетические данные для бенчмарков и нагрузочных тестов.
+
+fill() дополняет базу до заданного числа строк каждой модели, поэтому
+прерванную загрузку можно просто запустить ещё раз. Каждая пачка
+пишется в своей транзакции и генерируется из собственного seed
+(seed, модель, номер первой строки), так что повторный запуск
+продолжает ту же последовательность.
+
+Распределения близки к настоящим: у немногих авторов большая часть
+подписчиков, у немногих - большая часть постов, у немногих постов -
+большая часть комментариев (степенной закон, параметр skew). Посты
+появляются сериями с интервалом в несколько минут.
+
+Строки создаются через bulk_create, минуя сигналы, поэтому после
+загрузки производные данные (счётчики, ленты, поисковый индекс,
+миниатюры) пересчитываются один раз функцией rebuild_derived().
+"""
+import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image
+
+from . import search, thumbnails, timeline
+from .models import (Comment, Follow, Group, Post, User, UserStats,
+                     count_subquery)
+
+BATCH_SIZE = 1000
+PASSWORD = 'synthetic'
+WORDS = (
+    'лето горы море город кот собака книга фильм музыка кофе утро вечер '
+    'дорога друг работа отпуск поезд снег дождь солнце сад дом окно река '
+    'лес поле небо звезда песня рецепт пирог ягоды прогулка выходные'
+).split()
+# Сколько пачек подряд может не добавить ни одной строки (например,
+# все возможные подписки уже есть), прежде чем генерация остановится.
+MAX_EMPTY_BATCHES = 3
+
+
+@contextmanager
+def explicit_dates():
+    """
+    Отключает auto_now_add у дат постов и комментариев, чтобы
+    bulk_create сохранил заданные даты.
+    """
+    fields = [Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+@contextmanager
+def bulk_insert_mode():
+    """
+    Настраивает соединение на массовую вставку: SQLite не ждёт записи
+    на диск при каждом коммите и держит временные данные в памяти,
+    PostgreSQL не ждёт сброса WAL при коммите. Журнал не меняется:
+    если процесс убит посреди пачки, её транзакция откатывается,
+    и загрузку можно продолжить. После выхода настройки возвращаются.
+    Внутри внешней транзакции ничего не меняет: SQLite не разрешает
+    там менять эти настройки.
+    """
+    if connection.in_atomic_block:
+        yield
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA synchronous')
+            synchronous = cursor.fetchone()[0]
+            cursor.execute('PRAGMA temp_store')
+            temp_store = cursor.fetchone()[0]
+            cursor.execute('PRAGMA journal_mode')
+            # С журналом WAL режим NORMAL не портит базу даже при сбое
+            # питания, с журналом отката OFF не портит её при падении
+            # процесса - только при сбое ОС.
+            cursor.execute('PRAGMA synchronous = {}'.format(
+                'NORMAL' if cursor.fetchone()[0] == 'wal' else 'OFF'
+            ))
+            cursor.execute('PRAGMA temp_store = MEMORY')
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SET synchronous_commit TO OFF')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'PRAGMA synchronous = {synchronous}')
+                cursor.execute(f'PRAGMA temp_store = {temp_store}')
+            elif connection.vendor == 'postgresql':
+                cursor.execute('SET synchronous_commit TO DEFAULT')
+
+
+def bulk_create(model, objs, **kwargs):
+    """
+    bulk_create пачками не больше BATCH_SIZE и не больше, чем
+    позволяет число параметров запроса в базе.
+    """
+    fields = [field for field in model._meta.concrete_fields
+              if not field.primary_key]
+    batch_size = min(BATCH_SIZE, connection.ops.bulk_batch_size(
+        fields, [None] * BATCH_SIZE
+    ))
+    return model.objects.bulk_create(objs, batch_size=batch_size, **kwargs)
+
+
+def skewed(rng, items, skew):
+    """
+    Случайный элемент items со степенным распределением по позиции:
+    первые элементы выпадают чаще. skew = 1 - равномерно.
+    """
+    return items[int(len(items) * rng.random() ** skew)]
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, words)))
+
+
+def make_images(count):
+    """
+    Картинки posts/synthetic-N.png в хранилище, уже созданные
+    не перезаписываются. Возвращает имена.
+    """
+    names = []
+    for number in range(count):
+        name = f'posts/synthetic-{number}.png'
+        if not default_storage.exists(name):
+            rng = random.Random(number)
+            content = BytesIO()
+            color = tuple(rng.randrange(256) for _ in range(3))
+            Image.new('RGB', (320, 240), color).save(content, 'PNG')
+            default_storage.save(name, ContentFile(content.getvalue()))
+        names.append(name)
+    return names
+
+
+def top_up(model, target, make_rows, seed=0, batch_size=10000, log=None,
+           **kwargs):
+    """
+    Добавляет строки model, пока их не станет target. make_rows(rng,
+    offset, size) возвращает строки очередной пачки.
+    """
+    done = model.objects.count()
+    empty = 0
+    while done < target and empty < MAX_EMPTY_BATCHES:
+        size = min(batch_size, target - done)
+        rng = random.Random(f'{seed}:{model.__name__}:{done}:{empty}')
+        with transaction.atomic():
+            bulk_create(model, make_rows(rng, done, size), **kwargs)
+        added = model.objects.count() - done
+        done += added
+        empty = 0 if added else empty + 1
+        if log:
+            log(f'{model.__name__}: {done}/{target}')
+    return done
+
+
+def fill(users=1000, groups=20, posts=100000, follows=20000, comments=200000,
+         images=0, seed=0, skew=3.0, days=365, batch_size=10000, log=None,
+         rebuild=True):
+    """
+    Дополняет базу синтетическими данными до заданных размеров.
+    """
+    now = datetime.now()
+    password = make_password(PASSWORD)
+    options = {'seed': seed, 'batch_size': batch_size, 'log': log}
+
+    top_up(User, users, lambda rng, offset, size: [
+        User(username=f'user{number}', password=password)
+        for number in range(offset, offset + size)
+    ], ignore_conflicts=True, **options)
+    top_up(Group, groups, lambda rng, offset, size: [
+        Group(title=f'Группа {number}', slug=f'group-{number}',
+              description=sentence(rng))
+        for number in range(offset, offset + size)
+    ], ignore_conflicts=True, **options)
+
+    user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    # Активность авторов не связана с их популярностью: иначе самые
+    # читаемые авторы писали бы и больше всех, и ленты росли бы
+    # квадратично.
+    active_ids = user_ids[:]
+    random.Random(seed).shuffle(active_ids)
+    group_ids = list(
+        Group.objects.order_by('pk').values_list('pk', flat=True)
+    ) + [None]
+    image_names = make_images(min(images, posts))
+
+    def post_rows(rng, offset, size):
+        rows = []
+        while len(rows) < size:
+            # Серия постов одного автора с интервалом в несколько минут.
+            author_id = skewed(rng, active_ids, skew)
+            group_id = rng.choice(group_ids)
+            moment = now - timedelta(seconds=rng.randrange(days * 86400))
+            burst = min(int(rng.paretovariate(1.5)), 50, size - len(rows))
+            for _ in range(burst):
+                number = offset + len(rows)
+                rows.append(Post(
+                    text=sentence(rng, 40), author_id=author_id,
+                    group_id=group_id, pub_date=min(moment, now),
+                    image=(image_names[number]
+                           if number < len(image_names) else ''),
+                ))
+                moment += timedelta(seconds=rng.expovariate(1 / 300))
+        return rows
+
+    def comment_rows(rng, offset, size):
+        return [
+            Comment(post_id=skewed(rng, post_ids, skew),
+                    author_id=rng.choice(user_ids), text=sentence(rng),
+                    created=now - timedelta(
+                        seconds=rng.randrange(days * 86400)
+                    ))
+            for _ in range(size)
+        ]
+
+    def follow_rows(rng, offset, size):
+        rows = {}
+        for _ in range(size):
+            user_id = rng.choice(user_ids)
+            author_id = skewed(rng, user_ids, skew)
+            if user_id != author_id:
+                rows[user_id, author_id] = Follow(user_id=user_id,
+                                                  author_id=author_id)
+        return list(rows.values())
+
+    with bulk_insert_mode(), explicit_dates():
+        top_up(Post, posts, post_rows, **options)
+        post_ids = list(
+            Post.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        if post_ids:
+            top_up(Comment, comments, comment_rows, **options)
+        top_up(Follow, follows, follow_rows, ignore_conflicts=True,
+               **options)
+    if rebuild:
+        if log:
+            log('Пересчёт счётчиков, лент и поискового индекса')
+        rebuild_derived()
+
+
+def rebuild_derived():
+    """
+    Пересчитывает всё, что обычно поддерживают сигналы.
+    """
+    with transaction.atomic():
+        Post.objects.update(
+            comment_count=count_subquery(Comment.objects.all(), 'post')
+        )
+        UserStats.rebuild()
+        timeline.rebuild()
+        search.create_fts_table()
+        search.rebuild(Post.objects.all(), Comment.objects.all())
+    for name in Post.objects.exclude(image='').exclude(
+        image=None
+    ).values_list('image', flat=True).distinct():
+        thumbnails.generate_card_thumbnail(name)
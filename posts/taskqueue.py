@@ -0,0 +1,252 @@
+"""
+Фоновые задачи.
+
+Задача - функция, зарегистрированная декоратором @task. Вызов
+enqueue(имя, аргументы) или функция.delay(аргументы) добавляет строку
+Task в той же транзакции, что и изменения, которые её вызвали: откат
+отменяет и задачу, а воркер не увидит её до коммита.
+
+manage.py worker запускает пул процессов. Каждый процесс захватывает
+пачку задач одним UPDATE на время аренды TASK_LEASE_SECONDS (задачи
+упавшего процесса после аренды достаются другим), выполняет их
+и записывает результат. Перед запуском каждой задачи аренда
+продлевается: задачу, которую за время предыдущих уже забрал другой
+процесс, воркер пропускает. Упавшая задача повторяется через
+TASK_RETRY_DELAY * 2 ** (попытка - 1) секунд, после max_attempts
+попыток помечается как невыполненная.
+
+С TASKS_EAGER (по умолчанию при DEBUG) задача выполняется сразу при
+постановке - так работают runserver и тесты без воркера. Ошибка
+задачи и тогда не ломает запрос: она откатывается и пишется в лог.
+
+Метрики: по каждой выполненной задаче - JSON-строка в лог
+posts.taskqueue, сводка по очереди - stats().
+"""
+import json
+import logging
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum
+from django.utils import timezone
+
+from yatube.database import write_atomic
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+BATCH_SIZE = 20
+
+
+def task(name=None, max_attempts=5):
+    """
+    Регистрирует функцию как задачу. Аргументы задачи должны
+    сериализоваться в JSON.
+    """
+    def decorator(func):
+        func.task_name = name or f'{func.__module__}.{func.__name__}'
+        func.max_attempts = max_attempts
+        func.delay = lambda *args, key='': enqueue(func.task_name, *args,
+                                                   key=key)
+        REGISTRY[func.task_name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, *args, key=''):
+    """
+    Ставит задачу name(*args) в очередь. Если в очереди уже ждёт
+    задача с тем же непустым key, новая не добавляется.
+    """
+    if name not in REGISTRY:
+        raise KeyError(f'Неизвестная задача {name}')
+    if settings.TASKS_EAGER:
+        started = time.perf_counter()
+        try:
+            with write_atomic():
+                REGISTRY[name](*args)
+        except Exception:
+            logger.exception('Задача %s не выполнена', name)
+        else:
+            _log(name, 'done', 1, time.perf_counter() - started)
+        return None
+    # Выполняющаяся задача могла прочитать данные до этого изменения,
+    # поэтому новая поглощается только ещё не начатой.
+    if key and is_queued(key):
+        return None
+    # Между проверкой и вставкой задачу мог поставить другой процесс:
+    # дубль отсекает условный уникальный индекс по key.
+    try:
+        with transaction.atomic():
+            return Task.objects.create(name=name, args=json.dumps(list(args)),
+                                       key=key, run_at=timezone.now())
+    except IntegrityError:
+        return None
+
+
+def is_queued(key):
+    """
+    Ждёт ли в очереди задача с ключом key.
+    """
+    return (not settings.TASKS_EAGER
+            and Task.objects.filter(key=key, status=Task.QUEUED).exists())
+
+
+def _available(now):
+    return (Q(status=Task.QUEUED, run_at__lte=now)
+            | Q(status=Task.RUNNING, locked_until__lt=now))
+
+
+def claim(limit=BATCH_SIZE):
+    """
+    Захватывает до limit готовых задач одним UPDATE: два воркера
+    не получат одну и ту же задачу.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    ready = Task.objects.filter(_available(now)).order_by(
+        'run_at', 'pk'
+    ).values('pk')[:limit]
+    Task.objects.filter(_available(now), pk__in=ready).update(
+        status=Task.RUNNING, locked_by=token, attempts=F('attempts') + 1,
+        locked_until=now + timedelta(seconds=settings.TASK_LEASE_SECONDS),
+    )
+    return list(Task.objects.filter(locked_by=token, status=Task.RUNNING)
+                .order_by('run_at', 'pk'))
+
+
+def release(items):
+    """
+    Возвращает в очередь захваченные, но не начатые задачи.
+    """
+    for item in items:
+        task = Task.objects.filter(pk=item.pk, locked_by=item.locked_by)
+        try:
+            with transaction.atomic():
+                task.update(status=Task.QUEUED, attempts=F('attempts') - 1,
+                            locked_by='', locked_until=None)
+        except IntegrityError:
+            # Пока задача была захвачена, такую же поставили заново.
+            task.delete()
+
+
+def extend(item):
+    """
+    Продлевает аренду задачи. False - аренда истекла, и задачу
+    захватил другой процесс.
+    """
+    return Task.objects.filter(
+        pk=item.pk, locked_by=item.locked_by, status=Task.RUNNING
+    ).update(locked_until=timezone.now() + timedelta(
+        seconds=settings.TASK_LEASE_SECONDS
+    )) == 1
+
+
+def run(item):
+    """
+    Выполняет захваченную задачу и записывает результат. Задачу,
+    которую уже захватил другой процесс, пропускает и возвращает None.
+    """
+    if not extend(item):
+        return None
+    func = REGISTRY.get(item.name)
+    started = time.perf_counter()
+    try:
+        if func is None:
+            raise KeyError(f'Неизвестная задача {item.name}')
+        with write_atomic():
+            func(*json.loads(item.args))
+    except Exception:
+        elapsed = time.perf_counter() - started
+        now = timezone.now()
+        final = func is None or item.attempts >= func.max_attempts
+        changes = {'last_error': traceback.format_exc(),
+                   'duration_ms': elapsed * 1000, 'locked_until': None}
+        if final:
+            changes.update(status=Task.FAILED, finished=now)
+        else:
+            changes.update(status=Task.QUEUED, run_at=now + timedelta(
+                seconds=settings.TASK_RETRY_DELAY * 2 ** (item.attempts - 1)
+            ))
+        status = 'failed' if final else 'retry'
+    else:
+        elapsed = time.perf_counter() - started
+        changes = {'status': Task.DONE, 'finished': timezone.now(),
+                   'duration_ms': elapsed * 1000, 'locked_until': None}
+        status = 'done'
+    Task.objects.filter(pk=item.pk, locked_by=item.locked_by).update(
+        **changes
+    )
+    _log(item.name, status, item.attempts, elapsed)
+    return status
+
+
+def _log(name, status, attempt, elapsed):
+    logger.info(json.dumps({
+        'task': name, 'status': status, 'attempt': attempt,
+        'duration_ms': round(elapsed * 1000, 2),
+    }))
+
+
+def run_pending(limit=BATCH_SIZE):
+    """
+    Выполняет готовые задачи, пока они есть. Возвращает их число.
+    """
+    total = 0
+    while True:
+        batch = claim(limit)
+        if not batch:
+            return total
+        for item in batch:
+            run(item)
+        total += len(batch)
+
+
+def prune():
+    """
+    Удаляет выполненные задачи старше TASK_KEEP_SECONDS.
+    """
+    Task.objects.filter(
+        status=Task.DONE,
+        finished__lt=timezone.now() - timedelta(
+            seconds=settings.TASK_KEEP_SECONDS
+        ),
+    ).delete()
+
+
+def stats():
+    """
+    Сводка по именам задач: число задач в каждом статусе, повторы,
+    среднее и максимальное время выполнения, возраст самой старой
+    задачи в очереди в секундах.
+    """
+    now = timezone.now()
+    result = {}
+    rows = Task.objects.order_by().values('name', 'status').annotate(
+        total=Count('pk'), attempts=Sum('attempts'),
+        avg_ms=Avg('duration_ms'), max_ms=Max('duration_ms'),
+        oldest=Min('run_at'),
+    )
+    for row in rows:
+        name = result.setdefault(row['name'], {
+            'queued': 0, 'running': 0, 'done': 0, 'failed': 0,
+            'retries': 0, 'avg_ms': None, 'max_ms': None, 'lag': 0,
+        })
+        name[row['status']] = row['total']
+        if row['status'] != Task.QUEUED:
+            name['retries'] += (row['attempts'] or 0) - row['total']
+        else:
+            # В очереди лежат и ещё не запускавшиеся задачи, и отложенные
+            # повторы: каждая попытка уже была повтором.
+            name['retries'] += row['attempts'] or 0
+            name['lag'] = max((now - row['oldest']).total_seconds(), 0)
+        if row['status'] == Task.DONE:
+            name['avg_ms'] = round(row['avg_ms'] or 0, 2)
+            name['max_ms'] = round(row['max_ms'] or 0, 2)
+    return result
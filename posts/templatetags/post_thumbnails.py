@@ -0,0 +1,10 @@
+from django import template
+
+from posts.thumbnails import ready_card_thumbnail
+
+register = template.Library()
+
+
+@register.simple_tag
+def card_thumbnail(image):
+    return ready_card_thumbnail(image)
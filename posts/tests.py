@@ -1,12 +1,58 @@
+import json
 import os
+import re
+import shutil
+import sqlite3
 import tempfile
+import time
+from datetime import datetime
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
+from django.apps import apps
+from django.conf import settings
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.template import Context as TemplateContext
+from django.template import Template, engines
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from PIL import Image
 
-from posts.models import Follow, Group, Post, User
+from posts import (benchmark, digest, page_cache, search, synthetic,
+                   taskqueue, thumbnails, writequeue)
+from posts.models import (AppliedWrite, Comment, DigestRun, Follow, Group,
+                          Post, Task, TimelineEntry, User, UserStats)
+from posts.paginator import encode_cursor
+from users.forms import CreationForm
+from yatube.cache import ORIGINS_KEY, TieredCache
+from yatube.database import SQLITE_PRAGMAS, databases, write_atomic
+from yatube.precompile import precompile_templates
+from yatube.querycheck import QueryCheckError, check_queries, shape
+from yatube.routers import PIN_COOKIE
+
+
+class TempMediaMixin:
+    """
+    Файлы теста - во временном MEDIA_ROOT, который удаляется после
+    теста. Наследникам с собственным setUp нужно вызвать super().setUp().
+    """
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
 
 
 class ProfileTest(TestCase):
@@ -73,8 +119,9 @@ class TestUnauthorized(TestCase):
         self.assertEqual(Post.objects.all().count(), 0)
 
 
-class TestImage(TestCase):
+class TestImage(TempMediaMixin, TestCase):
     def setUp(self):
+        super().setUp()
         cache.clear()
         self.client = Client()
         self.user = User.objects.create_user(username="testuser", password="123456")
@@ -94,9 +141,6 @@ class TestImage(TestCase):
         img = Image.new('RGB', (60, 30), color=(73, 109, 137))
         img.save('test.png')
 
-    def tearDown(self):
-        os.remove('media/posts/test.png')
-
 
     def test_tag_post(self):
         with open('test.png', 'rb') as img:
@@ -180,6 +224,7 @@ class FollowTest(TestCase):
 
 class CacheTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.first_client = Client()
         self.second_client = Client()
         self.user = User.objects.create_user(username='golum', )
@@ -187,6 +232,1486 @@ class CacheTest(TestCase):
 
     def test_cache(self):
         self.second_client.get(reverse('index'))
+        Post.objects.bulk_create([Post(text='Мимо сигналов', author=self.user)])
+        response = self.second_client.get(reverse('index'))
+        self.assertNotContains(response, 'Мимо сигналов')
         self.first_client.post(reverse('new_post'), {'text': 'Тест кэша'})
         response = self.second_client.get(reverse('index'))
-        self.assertNotContains(response, 'Тест кэша')
+        self.assertContains(response, 'Тест кэша')
+
+    def test_cache_scopes(self):
+        post = Post.objects.create(text='Пост', author=self.user)
+        post_url = reverse('post', args=[self.user.username, post.id])
+        other = User.objects.create_user(username='smeagol')
+        self.second_client.get(post_url)
+        self.second_client.get(reverse('profile', args=[other.username]))
+        Comment.objects.create(post=post, author=other, text='Комментарий')
+        self.assertContains(self.second_client.get(post_url), 'Комментарий')
+        with self.assertNumQueries(0):
+            self.second_client.get(reverse('profile', args=[other.username]))
+
+    def test_authorized_not_cached(self):
+        self.first_client.get(reverse('index'))
+        Post.objects.bulk_create([Post(text='Мимо сигналов', author=self.user)])
+        response = self.first_client.get(reverse('index'))
+        self.assertContains(response, 'Мимо сигналов')
+
+
+class KeysetPaginatorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='golum')
+        for i in range(25):
+            Post.objects.create(text=f'Пост {i}', author=self.user)
+
+    def test_cursor_walk(self):
+        response = self.client.get(reverse('index'))
+        cursor = response.context['cursor']
+        seen = [post.id for post in response.context['page']]
+        self.assertFalse(cursor.has_previous())
+        while cursor.has_next():
+            response = self.client.get(reverse('index'),
+                                       {'after': cursor.next_cursor})
+            cursor = response.context['cursor']
+            seen += [post.id for post in response.context['page']]
+        expected = list(Post.objects.order_by('-pub_date', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        response = self.client.get(reverse('index'),
+                                   {'before': cursor.previous_cursor})
+        self.assertEqual([post.id for post in response.context['page']],
+                         expected[10:20])
+
+    def test_no_count_query(self):
+        group = Group.objects.create(title='testgroup', slug='testslug')
+        Post.objects.update(group=group)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('group', args=[group.slug]))
+        self.assertFalse(any('__count' in query['sql']
+                             or 'OFFSET' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_page_number_compat(self):
+        response = self.client.get(reverse('index'), {'page': 3})
+        self.assertEqual(response.context['page'].number, 3)
+        self.assertEqual(len(response.context['page']), 5)
+        self.assertContains(response, '?page=2')
+
+
+class QueryCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='golum')
+        self.reader = User.objects.create_user(username='smeagol')
+        self.group = Group.objects.create(title='testgroup', slug='testslug')
+        Follow.objects.create(user=self.reader, author=self.user)
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(text=f'Пост {i}', author=self.user,
+                                       group=self.group)
+            Comment.objects.create(post=post, author=self.reader, text='!')
+
+    def assert_fixed_queries(self, url, num):
+        for count in (1, 10):
+            self.create_posts(count)
+            with self.assertNumQueries(num):
+                self.client.get(url)
+
+    def test_index(self):
+        self.assert_fixed_queries(reverse('index'), 1)
+
+    def test_group(self):
+        self.assert_fixed_queries(reverse('group', args=[self.group.slug]), 2)
+
+    def test_profile(self):
+        self.assert_fixed_queries(reverse('profile', args=[self.user]), 3)
+
+    def test_post_view(self):
+        self.create_posts(1)
+        post = Post.objects.get()
+        for i in range(5):
+            Comment.objects.create(post=post, author=self.user, text='!')
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse('post', args=[self.user.username, post.id])
+            )
+        self.assertContains(response, '6 комментариев')
+        self.assertContains(response, 'Подписчиков: 1')
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='golum')
+        self.author = User.objects.create_user(username='smeagol')
+        self.client.force_login(self.user)
+        self.post = Post.objects.create(text='Пост', author=self.author)
+
+    def assert_stats(self, user, posts, following, follower):
+        stats = UserStats.objects.get(user=user)
+        self.assertEqual(
+            (stats.posts_count, stats.following_count, stats.follower_count),
+            (posts, following, follower)
+        )
+
+    def test_follow_counters(self):
+        for _ in range(2):
+            self.client.get(reverse('profile_follow', args=[self.author]))
+        self.assert_stats(self.author, 1, 1, 0)
+        self.assert_stats(self.user, 0, 0, 1)
+        self.client.get(reverse('profile_unfollow', args=[self.author]))
+        self.assert_stats(self.author, 1, 0, 0)
+        self.assert_stats(self.user, 0, 0, 0)
+
+    def test_post_and_comment_counters(self):
+        self.client.post(reverse('add_comment',
+                                 args=[self.author, self.post.id]),
+                         {'text': 'Комментарий'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.post.comments.all().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+        self.post.delete()
+        self.assert_stats(self.author, 0, 0, 0)
+
+    def test_failed_counter_rolls_back_save(self):
+        with mock.patch('posts.signals.change_stats',
+                        side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Follow.objects.create(user=self.user, author=self.author)
+        self.assertFalse(Follow.objects.exists())
+        self.assert_stats(self.author, 1, 0, 0)
+
+    def test_rebuild_counters(self):
+        Comment.objects.create(post=self.post, author=self.user, text='!')
+        Follow.objects.create(user=self.user, author=self.author)
+        UserStats.objects.all().delete()
+        Post.objects.update(comment_count=0)
+        call_command('rebuild_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assert_stats(self.author, 1, 1, 0)
+        self.assert_stats(self.user, 0, 0, 1)
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='golum')
+        self.author = User.objects.create_user(username='smeagol')
+        self.star = User.objects.create_user(username='sauron')
+        self.client.force_login(self.user)
+
+    def feed_ids(self, **params):
+        response = self.client.get(reverse('follow_index'), params)
+        return [post.id for post in response.context['page']]
+
+    def test_fan_out_backfill_prune(self):
+        old = Post.objects.create(text='Старый', author=self.author)
+        self.client.get(reverse('profile_follow', args=[self.author]))
+        new = Post.objects.create(text='Новый', author=self.author)
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=self.user)
+                 .order_by('-pub_date', '-post_id')
+                 .values_list('post_id', flat=True)),
+            [new.id, old.id]
+        )
+        self.assertEqual(self.feed_ids(), [new.id, old.id])
+        self.client.get(reverse('profile_unfollow', args=[self.author]))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        self.assertEqual(self.feed_ids(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2)
+    def test_heavy_author_read_path(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.user, author=self.star)
+        Follow.objects.create(user=self.author, author=self.star)
+        for i in range(12):
+            Post.objects.create(text=f'Пост {i}',
+                                author=self.author if i % 2 else self.star)
+        self.assertFalse(
+            TimelineEntry.objects.filter(post__author=self.star).exists()
+        )
+        self.assertTrue(
+            TimelineEntry.objects.filter(post__author=self.author).exists()
+        )
+        expected = list(Post.objects.order_by('-pub_date', '-id')
+                        .values_list('id', flat=True))
+        response = self.client.get(reverse('follow_index'))
+        cursor = response.context['cursor']
+        seen = [post.id for post in response.context['page']]
+        self.assertTrue(cursor.has_next())
+        seen += self.feed_ids(after=cursor.next_cursor)
+        self.assertEqual(seen, expected)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2)
+    def test_author_stops_being_heavy(self):
+        Follow.objects.create(user=self.user, author=self.star)
+        Follow.objects.create(user=self.author, author=self.star)
+        post = Post.objects.create(text='Пока звезда', author=self.star)
+        self.assertEqual(self.feed_ids(), [post.id])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.feed_ids(), [post.id])
+        self.assertFalse([query for query in queries
+                          if 'following_count' in query['sql']])
+        Follow.objects.filter(user=self.author).delete()
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('user', 'post')),
+            [(self.user.id, post.id)]
+        )
+        self.assertEqual(self.feed_ids(), [post.id])
+
+
+class PostCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='golum')
+        self.reader = User.objects.create_user(username='smeagol')
+        self.group = Group.objects.create(title='testgroup', slug='testslug')
+        self.post = Post.objects.create(text='Старый текст', author=self.user,
+                                        group=self.group)
+        self.client.force_login(self.user)
+
+    def test_card_is_reused(self):
+        self.client.get(reverse('index'))
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
+        response = self.client.get(
+            reverse('profile', args=[self.user.username])
+        )
+        self.assertContains(response, 'Старый текст')
+
+    def test_card_versions(self):
+        self.client.get(reverse('index'))
+        self.client.post(reverse('add_comment',
+                                 args=[self.user.username, self.post.id]),
+                         {'text': 'Комментарий'})
+        self.assertContains(self.client.get(reverse('index')),
+                            '1 комментариев')
+        self.group.title = 'newgroup'
+        self.group.save()
+        self.assertContains(self.client.get(reverse('index')), '#newgroup')
+        self.client.post(reverse('post_edit',
+                                 args=[self.user.username, self.post.id]),
+                         {'text': 'Новый текст', 'group': self.group.id})
+        self.assertContains(self.client.get(reverse('index')), 'Новый текст')
+
+    def test_edit_link_is_per_viewer(self):
+        edit_url = reverse('post_edit', args=[self.user.username, self.post.id])
+        self.assertContains(self.client.get(reverse('index')), edit_url)
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.client.get(reverse('index')), edit_url)
+
+
+class TieredCacheTest(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.settings_override = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'shared': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.location,
+            },
+        })
+        self.settings_override.enable()
+        params = {'OPTIONS': {'POLL_INTERVAL': 0}}
+        self.first = TieredCache('shared', params)
+        self.second = TieredCache('shared', params)
+
+    def tearDown(self):
+        self.first.clear()
+        self.settings_override.disable()
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def test_tiers_and_stats(self):
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertIsNone(self.second.get('missing'))
+        stats = self.second.stats()
+        self.assertEqual((stats['l2_hits'], stats['l1_hits'], stats['misses']),
+                         (1, 1, 1))
+
+    def test_cross_process_invalidation(self):
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_concurrent_writers(self):
+        third = TieredCache('shared', {'OPTIONS': {'POLL_INTERVAL': 0}})
+        for key in 'ab':
+            self.first.set(key, 'old')
+            self.assertEqual(self.second.get(key), 'old')
+        # Номер сообщения не берётся из общего incr(): даже если бы он
+        # выдал обоим процессам один номер, оба сообщения дойдут.
+        with mock.patch.object(type(self.first.shared), 'incr',
+                               return_value=1):
+            self.first.set('a', 'first')
+            third.set('b', 'third')
+        self.assertEqual(self.second.get('a'), 'first')
+        self.assertEqual(self.second.get('b'), 'third')
+
+    def test_registry_overwritten(self):
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        # Другой процесс регистрировался одновременно и затёр реестр.
+        self.first.shared.set(ORIGINS_KEY, {}, None)
+        self.second.get('key')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+
+    def test_l1_is_bounded(self):
+        small = TieredCache('shared', {'OPTIONS': {'L1_MAX_ENTRIES': 2}})
+        for key in 'abc':
+            small.set(key, key)
+        self.assertEqual(small.stats()['l1_entries'], 2)
+        self.assertEqual(small.get('a'), 'a')
+        self.assertEqual(small.stats()['l2_hits'], 1)
+
+
+@override_settings(TASKS_EAGER=True)
+class ThumbnailTest(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='golum')
+        self.client.force_login(self.user)
+
+    def upload(self):
+        image = BytesIO()
+        Image.new('RGB', (60, 30), color=(73, 109, 137)).save(image, 'PNG')
+        return SimpleUploadedFile('card.png', image.getvalue(),
+                                  content_type='image/png')
+
+    def test_generated_on_save(self):
+        self.client.post(reverse('new_post'),
+                         {'text': 'С картинкой', 'image': self.upload()})
+        post = Post.objects.get()
+        self.assertIsNotNone(thumbnails.backend.get_ready_thumbnail(
+            post.image, thumbnails.CARD_GEOMETRY, **thumbnails.CARD_OPTIONS
+        ))
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, settings.MEDIA_URL + 'cache/')
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(
+            response, settings.MEDIA_URL + 'posts/derivatives/card-480.webp 480w'
+        )
+
+    def test_placeholder_until_ready(self):
+        with mock.patch('posts.thumbnails.schedule'):
+            self.client.post(reverse('new_post'),
+                             {'text': 'С картинкой', 'image': self.upload()})
+        with mock.patch.object(thumbnails.generate_card_thumbnail,
+                               'delay') as delay:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Изображение обрабатывается')
+        name = Post.objects.get().image.name
+        delay.assert_called_once_with(name, key=f'thumbnail:{name}')
+
+    def test_derivatives_are_optional(self):
+        with mock.patch('posts.thumbnails.build_derivatives',
+                        side_effect=OSError('нет места')), \
+                self.assertLogs('posts.thumbnails', 'ERROR'):
+            self.client.post(reverse('new_post'),
+                             {'text': 'С картинкой', 'image': self.upload()})
+        self.assertEqual(Post.objects.get().image_derivatives, '')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, settings.MEDIA_URL + 'cache/')
+        self.assertNotContains(response, 'Изображение обрабатывается')
+
+    def test_derivatives_removed(self):
+        def files():
+            directory = os.path.join(settings.MEDIA_ROOT, 'posts/derivatives')
+            return sorted(os.listdir(directory))
+
+        self.client.post(reverse('new_post'),
+                         {'text': 'С картинкой', 'image': self.upload()})
+        post = Post.objects.get()
+        first = files()
+        self.assertTrue(first)
+        with mock.patch('django.db.transaction.on_commit',
+                        lambda func: func()):
+            self.client.post(
+                reverse('post_edit', args=['golum', post.pk]),
+                {'text': 'Новая картинка', 'image': self.upload()}
+            )
+            self.assertTrue(files())
+            self.assertFalse(set(first) & set(files()))
+            Post.objects.get().delete()
+        self.assertEqual(files(), [])
+
+    def test_derivatives_rebuilt_in_place(self):
+        self.client.post(reverse('new_post'),
+                         {'text': 'С картинкой', 'image': self.upload()})
+        post = Post.objects.get()
+        directory = os.path.join(settings.MEDIA_ROOT, 'posts/derivatives')
+        first = sorted(os.listdir(directory))
+        thumbnails.generate_card_thumbnail(post.image.name)
+        self.assertEqual(Post.objects.get().image_derivatives,
+                         post.image_derivatives)
+        # Как после synthetic.rebuild_derived(): копии пересобираются.
+        Post.objects.update(image_derivatives='')
+        thumbnails.generate_card_thumbnail(post.image.name)
+        self.assertEqual(sorted(os.listdir(directory)), first)
+        self.assertEqual(Post.objects.get().image_derivatives,
+                         post.image_derivatives)
+
+
+@override_settings(TASKS_EAGER=True)
+class ImageUploadTest(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.user = User.objects.create_user(username='golum')
+        self.client.force_login(self.user)
+
+    def upload(self, size=(60, 30), fmt='PNG', **save_options):
+        image = BytesIO()
+        Image.new('RGB', size, color=(73, 109, 137)).save(
+            image, fmt, **save_options
+        )
+        return SimpleUploadedFile(f'photo.{fmt.lower()}', image.getvalue())
+
+    def post(self, image):
+        with mock.patch('posts.thumbnails.schedule'):
+            return self.client.post(reverse('new_post'),
+                                    {'text': 'С картинкой', 'image': image})
+
+    def test_valid_upload(self):
+        response = self.post(self.upload())
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Post.objects.get().image)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=100)
+    def test_spooled_to_disk(self):
+        response = self.post(self.upload(size=(200, 200)))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Post.objects.get().image.width, 200)
+
+    @override_settings(UPLOAD_IMAGE_MAX_BYTES=1024 * 1024)
+    def test_too_many_bytes(self):
+        content = self.upload().read() + os.urandom(1024 * 1024)
+        response = self.post(SimpleUploadedFile('photo.png', content))
+        self.assertFormError(response, 'form', 'image', 'Файл больше 1 МБ.')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(UPLOAD_IMAGE_MAX_PIXELS=10 ** 6)
+    def test_too_many_pixels(self):
+        response = self.post(self.upload(size=(1001, 1000)))
+        self.assertFormError(response, 'form', 'image',
+                             'Изображение больше 1 Мпикс.')
+        self.assertFalse(Post.objects.exists())
+
+    def test_exif_stripped_orientation_kept(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Camera'
+        exif[0x0131] = 'Editor'
+        response = self.post(self.upload(fmt='JPEG', exif=exif.tobytes()))
+        self.assertEqual(response.status_code, 302)
+        with Image.open(Post.objects.get().image.path) as saved:
+            self.assertEqual(dict(saved.getexif()), {0x0112: 6})
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='golum')
+        self.group = Group.objects.create(
+            title='Путешествия', slug='travel', description='Группа'
+        )
+        self.post = Post.objects.create(
+            text='Поехали в горы на выходных', author=self.user,
+            group=self.group
+        )
+        self.other = Post.objects.create(
+            text='Рецепт пирога с горами ягод', author=self.user
+        )
+
+    def find(self, query, after=None):
+        return [post.pk for post in search.search(query, after=after)]
+
+    def test_stemmed_match(self):
+        self.assertCountEqual(self.find('горах'),
+                              [self.post.pk, self.other.pk])
+        self.assertEqual(self.find('поехал'), [self.post.pk])
+        self.assertEqual(self.find('путешествие'), [self.post.pk])
+        self.assertEqual(self.find('пироги ягоды'), [self.other.pk])
+        self.assertEqual(self.find('пироги горы поехали'), [])
+
+    def test_incremental_updates(self):
+        comment = Comment.objects.create(
+            post=self.other, author=self.user, text='Отличная выпечка'
+        )
+        self.assertEqual(self.find('выпечку'), [self.other.pk])
+        comment.delete()
+        self.assertEqual(self.find('выпечку'), [])
+        self.post.text = 'Остались дома'
+        self.post.save()
+        self.assertEqual(self.find('поехали'), [])
+        self.group.title = 'Отпуск'
+        self.group.save()
+        self.assertEqual(self.find('отпуска'), [self.post.pk])
+        self.group.delete()
+        self.assertEqual(self.find('отпуск'), [])
+        self.post.delete()
+        self.assertEqual(self.find('дома'), [])
+
+    def test_new_comment_indexed_alone(self):
+        Comment.objects.create(post=self.other, author=self.user,
+                               text='Отличная выпечка')
+        with CaptureQueriesContext(connection) as queries:
+            Comment.objects.create(post=self.other, author=self.user,
+                                   text='Сладкая начинка')
+        self.assertFalse([query for query in queries
+                          if '"posts_comment"."post_id" IN' in query['sql']])
+        self.assertEqual(self.find('выпечку начинки'), [self.other.pk])
+
+    def test_ranking_and_cursor(self):
+        for number in range(12):
+            Post.objects.create(text=f'Ягоды {number}', author=self.user)
+        Post.objects.create(text='Ягоды, ягоды и ещё ягоды',
+                            author=self.user)
+        first = search.search('ягоды')
+        self.assertEqual(first.object_list[0].text,
+                         'Ягоды, ягоды и ещё ягоды')
+        self.assertTrue(first.has_next())
+        second = search.search('ягоды', after=first.next_cursor)
+        self.assertFalse(second.has_next())
+        found = [post.pk for post in list(first) + list(second)]
+        self.assertEqual(len(found), 14)
+        self.assertEqual(len(set(found)), 14)
+
+    def test_view(self):
+        response = self.client.get(reverse('search'), {'q': 'выходные'})
+        self.assertContains(response, 'Поехали в горы')
+        self.assertNotContains(response, 'Рецепт пирога')
+
+    def test_migration_fills_index(self):
+        search.get_backend().clear()
+        self.assertEqual(self.find('горах'), [])
+        import_module(
+            'posts.migrations.0023_fill_search_index'
+        ).fill_search_index(apps, None)
+        self.assertCountEqual(self.find('горах'),
+                              [self.post.pk, self.other.pk])
+
+    def test_search_username_reserved(self):
+        password = 'Vx7-search-pass'
+        form = CreationForm({'username': 'search', 'password1': password,
+                             'password2': password})
+        self.assertIn('username', form.errors)
+        form = CreationForm({'username': 'searcher', 'password1': password,
+                             'password2': password})
+        self.assertTrue(form.is_valid(), form.errors)
+
+
+@override_settings(SEARCH_BACKEND='python')
+class PythonSearchTest(SearchTest):
+    def test_postings(self):
+        self.assertTrue(
+            self.post.search_postings.filter(term='гор').exists()
+        )
+
+    def test_appended_comment_matches_full_reindex(self):
+        for text in ('Горы и ягоды', 'Ещё ягоды'):
+            Comment.objects.create(post=self.other, author=self.user,
+                                   text=text)
+
+        def postings():
+            return set(self.other.search_postings.values_list('term',
+                                                              'weight'))
+
+        appended = postings()
+        search.index_posts([self.other.pk])
+        self.assertEqual(appended, postings())
+
+    def test_scored_in_sql(self):
+        self.find('горах')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertCountEqual(self.find('горах'),
+                                  [self.post.pk, self.other.pk])
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('sqlite_master', sql)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertIn('HAVING', sql)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN - SQLite')
+class QueryPlanTest(TestCase):
+    """
+    Каждый запрос страниц лент должен идти по индексу: без полного
+    просмотра таблицы и без сортировки во временном B-дереве.
+    """
+    FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username='golum')
+        self.reader = User.objects.create_user(username='frodo')
+        self.group = Group.objects.create(title='Группа', slug='group',
+                                          description='Описание')
+        for number in range(12):
+            self.post = Post.objects.create(text=f'Пост {number}',
+                                            author=self.author,
+                                            group=self.group)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client.force_login(self.reader)
+
+    def bad_plans(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        bad = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                details = [row[-1] for row in cursor.fetchall()]
+                if any(self.FULL_SCAN.match(detail)
+                       or 'TEMP B-TREE' in detail for detail in details):
+                    bad.append((query['sql'], details))
+        return bad
+
+    def test_feed_queries_use_indexes(self):
+        cursor = encode_cursor(self.post.pub_date, self.post.pk)
+        urls = [
+            reverse('index'),
+            reverse('group', args=[self.group.slug]),
+            reverse('profile', args=[self.author.username]),
+            reverse('post', args=[self.author.username, self.post.pk]),
+            reverse('follow_index'),
+        ]
+        for url in urls:
+            for query in ('', f'?after={cursor}', f'?before={cursor}'):
+                with self.subTest(url=url + query):
+                    self.assertEqual(self.bad_plans(url + query), [])
+
+
+@override_settings(TASKS_EAGER=True)
+class BenchmarkTest(TempMediaMixin, TestCase):
+    def test_synthetic_dataset(self):
+        synthetic.fill(users=10, groups=2, posts=30, follows=15,
+                       comments=40, images=1)
+        self.assertEqual(Post.objects.count(), 30)
+        self.assertEqual(Comment.objects.count(), 40)
+        post = Post.objects.order_by('-comment_count').first()
+        self.assertEqual(post.comment_count, post.comments.count())
+        follow = Follow.objects.first()
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=follow.user).count(),
+            Post.objects.filter(
+                author__following__user=follow.user
+            ).count()
+        )
+
+    def test_run_and_compare(self):
+        synthetic.fill(users=10, groups=2, posts=30, follows=15,
+                       comments=40)
+        results = benchmark.run(repeat=3, warmup=1)
+        self.assertEqual(set(results), {
+            'index', 'group_posts', 'profile', 'post_view', 'follow_index',
+            'new_post', 'add_comment',
+        })
+        for name, stats in results.items():
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+            self.assertTrue(all(status < 400 for status in stats['status']),
+                            name)
+        slower = dict(results['index'], p95_ms=results['index']['p95_ms'] * 2,
+                      queries=results['index']['queries'] + 1)
+        self.assertEqual(
+            len(benchmark.compare(results, {'index': slower}, 0.2)), 2
+        )
+        self.assertEqual(benchmark.compare(results, results), [])
+
+
+class GenerateDataTest(TestCase):
+    def test_resume(self):
+        options = {'users': 20, 'groups': 3, 'comments': 50, 'follows': 40,
+                   'batch_size': 7, 'verbosity': 0, 'stdout': StringIO()}
+        call_command('generate_data', posts=30, skip_rebuild=True, **options)
+        self.assertEqual(Post.objects.count(), 30)
+        self.assertFalse(TimelineEntry.objects.exists())
+        call_command('generate_data', posts=60, **options)
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertEqual(Comment.objects.count(), 50)
+        self.assertEqual(Follow.objects.count(), 40)
+        self.assertEqual(UserStats.objects.get(
+            user=Post.objects.first().author
+        ).posts_count, Post.objects.filter(
+            author=Post.objects.first().author
+        ).count())
+        call_command('generate_data', posts=60, **options)
+        self.assertEqual(Post.objects.count(), 60)
+
+    def test_power_law(self):
+        synthetic.fill(users=200, groups=1, posts=0, comments=0,
+                       follows=2000, skew=3)
+        counts = sorted(UserStats.objects.values_list(
+            'following_count', flat=True
+        ), reverse=True)
+        self.assertGreater(counts[0], 10 * counts[len(counts) // 2])
+
+
+class PerformanceMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='perf', password='123')
+        Post.objects.create(text='Замер', author=self.user)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=1)
+    def test_server_timing(self):
+        with self.assertLogs('yatube.performance', 'INFO') as logs:
+            response = self.client.get(reverse('index'))
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'db;dur=', 'cache;desc=',
+                       'template;dur=', 'thumbnail;dur='):
+            self.assertIn(metric, timing)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'index')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['db_queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertGreater(record['cache_hits'] + record['cache_misses'], 0)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class QueryCheckTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        post = Post.objects.create(
+            text='Пост', author=User.objects.create_user(username='owner')
+        )
+        for number in range(5):
+            Comment.objects.create(
+                post=post, text='Комментарий',
+                author=User.objects.create_user(username=f'reader{number}')
+            )
+
+    def test_template_line(self):
+        template = Template(
+            '{% for item in items %}\n{{ item.author.username }}\n{% endfor %}'
+        )
+        with self.assertRaises(QueryCheckError) as error:
+            with check_queries():
+                template.render(TemplateContext({
+                    'items': Comment.objects.all()
+                }))
+        self.assertIn('5 запросов одной формы', str(error.exception))
+        self.assertIn('<unknown source>:2', str(error.exception))
+        with check_queries():
+            template.render(TemplateContext({
+                'items': Comment.objects.select_related('author')
+            }))
+
+    def test_code_line(self):
+        with self.assertRaises(QueryCheckError) as error:
+            with check_queries(threshold=4):
+                [comment.author for comment in Comment.objects.all()]
+        self.assertIn('posts/tests.py:', str(error.exception))
+
+    def test_shape(self):
+        self.assertEqual(
+            shape("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x'"),
+            shape('SELECT * FROM t WHERE id IN (%s) AND name = %s'),
+        )
+
+    @override_settings(QUERY_CHECK_THRESHOLD=0)
+    def test_middleware_logs(self):
+        with self.assertLogs('yatube.querycheck', 'WARNING') as logs:
+            self.client.get(reverse('index'))
+        self.assertIn('GET / (index)', logs.output[0])
+
+
+@mock.patch('posts.paginator.COMMENTS_PER_PAGE', 3)
+class CommentPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='writer')
+        self.post = Post.objects.create(text='Обсуждение', author=self.author)
+        with synthetic.explicit_dates():
+            created = datetime(2021, 1, 1)
+            self.comments = [
+                Comment.objects.create(
+                    post=self.post, text=f'Комментарий {number}',
+                    created=created,
+                    author=User.objects.create_user(
+                        username=f'commenter{number}'
+                    )
+                )
+                for number in range(7)
+            ]
+
+    def test_batches(self):
+        url = reverse('post', args=[self.author.username, self.post.pk])
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['items']), self.comments[:3])
+        self.assertContains(response, 'Загрузить ещё')
+        more = reverse('post_comments',
+                       args=[self.author.username, self.post.pk])
+        seen = self.comments[:3]
+        after = response.context['next_cursor']
+        while after:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(more, {'after': after})
+            # Пост, порция комментариев с авторами и EXISTS.
+            self.assertLessEqual(len(queries), 3)
+            seen += list(response.context['items'])
+            self.assertNotContains(response, '<html')
+            after = response.context['next_cursor']
+        self.assertEqual(seen, self.comments)
+        self.assertNotContains(response, 'Загрузить ещё')
+
+    def test_queries_do_not_grow(self):
+        url = reverse('post', args=[self.author.username, self.post.pk])
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        for number in range(20):
+            Comment.objects.create(post=self.post, author=self.author,
+                                   text=f'Ещё {number}')
+        cache.clear()
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        self.assertEqual(len(few), len(many))
+
+
+class ApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='api_author')
+        self.reader = User.objects.create_user(username='api_reader')
+        self.group = Group.objects.create(title='API', slug='api')
+        self.posts = [
+            Post.objects.create(text=f'Пост {number}', author=self.author,
+                                group=self.group)
+            for number in range(12)
+        ]
+        Comment.objects.create(post=self.posts[-1], author=self.reader,
+                               text='Первый')
+
+    def test_feeds(self):
+        response = self.client.get(reverse('api_index'))
+        data = response.json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(data['results'][0], {
+            'id': self.posts[-1].pk, 'text': 'Пост 11',
+            'pub_date': self.posts[-1].pub_date.isoformat(),
+            'author': 'api_author', 'group': 'api', 'image': None,
+            'comment_count': 1, 'version': 1,
+        })
+        rest = self.client.get(reverse('api_index'),
+                               {'after': data['next']}).json()
+        self.assertEqual([post['id'] for post in rest['results']],
+                         [self.posts[1].pk, self.posts[0].pk])
+        self.assertIsNone(rest['next'])
+        for url in (reverse('api_group', args=['api']),
+                    reverse('api_profile', args=['api_author'])):
+            self.assertEqual(self.client.get(url).json()['results'],
+                             data['results'])
+        self.assertEqual(
+            self.client.get(reverse('api_group', args=['none'])).status_code,
+            404
+        )
+
+    def test_post_and_comments(self):
+        post = self.posts[-1]
+        data = self.client.get(reverse('api_post', args=[post.pk])).json()
+        self.assertEqual(data['id'], post.pk)
+        comments = self.client.get(
+            reverse('api_post_comments', args=[post.pk])
+        ).json()
+        self.assertEqual(comments['results'][0]['author'], 'api_reader')
+        self.assertIsNone(comments['next'])
+
+    def test_no_queries_per_row(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('api_index'))
+        Post.objects.bulk_create([
+            Post(text='Ещё', author=User.objects.create_user(f'extra{number}'))
+            for number in range(10)
+        ])
+        cache.clear()
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('api_index'))
+        self.assertEqual(len(few), len(many))
+
+    def test_not_modified(self):
+        url = reverse('api_group', args=['api'])
+        response = self.client.get(url)
+        etag, modified = response['ETag'], response['Last-Modified']
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+            )
+            self.assertEqual(self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=modified
+            ).status_code, 304)
+        Post.objects.create(text='Новый', author=self.author, group=self.group)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['text'], 'Новый')
+
+    def test_modified_in_same_second(self):
+        url = reverse('api_group', args=['api'])
+        with mock.patch('posts.page_cache.time.time', return_value=1e9):
+            modified = self.client.get(url)['Last-Modified']
+            Post.objects.create(text='Новый', author=self.author,
+                                group=self.group)
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(parse_http_date(response['Last-Modified']),
+                           parse_http_date(modified))
+
+    def test_follow(self):
+        url = reverse('api_follow_index')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client.force_login(self.reader)
+        response = self.client.get(url)
+        self.assertEqual(len(response.json()['results']), 10)
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code, 304)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='cond_author')
+        self.reader = User.objects.create_user(username='cond_reader')
+        self.group = Group.objects.create(title='Условный', slug='cond')
+        self.post = Post.objects.create(text='Пост', author=self.author,
+                                        group=self.group)
+        self.urls = [
+            reverse('index'),
+            reverse('group', args=['cond']),
+            reverse('profile', args=['cond_author']),
+            reverse('post', args=['cond_author', self.post.pk]),
+        ]
+
+    def test_anonymous(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag']
+                ).status_code, 304)
+                self.assertEqual(self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+                ).status_code, 304)
+
+    def test_changes(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Новый комментарий')
+        for url in self.urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_viewer(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.reader)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # Сессия и пользователь, но не лента и не шаблон.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            ).status_code, 304)
+
+    def test_no_last_modified_for_users(self):
+        url = self.urls[0]
+        modified = self.client.get(url)['Last-Modified']
+        self.client.force_login(self.reader)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_versions_expire(self):
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add, \
+                mock.patch.object(cache, 'set_many',
+                                  wraps=cache.set_many) as set_many:
+            cache.clear()
+            self.client.get(self.urls[0])
+            page_cache.purge_pages('index')
+        self.assertEqual(add.call_args[0][2], settings.PAGE_CACHE_TIMEOUT)
+        self.assertEqual(set_many.call_args[0][1],
+                         settings.PAGE_CACHE_TIMEOUT)
+
+
+class PrecompileTemplatesTest(TestCase):
+    def setUp(self):
+        self.templates_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.templates_dir)
+        os.mkdir(os.path.join(self.templates_dir, 'includes'))
+        with open(os.path.join(self.templates_dir, 'includes',
+                               'item.html'), 'w') as template:
+            template.write('{{ item }}')
+
+    def templates(self):
+        return [{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'DIRS': [self.templates_dir],
+            'OPTIONS': {'loaders': [(
+                'django.template.loaders.cached.Loader',
+                ['django.template.loaders.filesystem.Loader'],
+            )]},
+        }]
+
+    def test_cached(self):
+        with override_settings(TEMPLATES=self.templates()):
+            self.assertEqual(precompile_templates(), 1)
+            loader = engines.all()[0].engine.template_loaders[0]
+            self.assertIn('includes/item.html', loader.get_template_cache)
+
+    def test_errors(self):
+        with open(os.path.join(self.templates_dir, 'broken.html'),
+                  'w') as template:
+            template.write('{% if %}')
+        with override_settings(TEMPLATES=self.templates()):
+            with self.assertRaisesMessage(ImproperlyConfigured,
+                                          'broken.html'):
+                precompile_templates()
+
+    def test_project(self):
+        out = StringIO()
+        call_command('precompile_templates', stdout=out)
+        self.assertIn('Шаблонов разобрано', out.getvalue())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'прагмы SQLite')
+class SqliteTuningTest(TransactionTestCase):
+    # Копия базы через backup() ждёт, пока закончится транзакция,
+    # поэтому без обёртки TestCase.
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0],
+                             SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0],
+                             SQLITE_PRAGMAS['cache_size'])
+
+    def test_databases(self):
+        config = databases('/srv', {'YATUBE_DB_CONN_MAX_AGE': '30'})
+        self.assertEqual(config['default']['NAME'], '/srv/db.sqlite3')
+        self.assertEqual(config['default']['CONN_MAX_AGE'], 30)
+        config = databases('/srv', {'YATUBE_DB': 'postgresql',
+                                    'YATUBE_DB_PGBOUNCER': '1'})
+        self.assertEqual(config['default']['ENGINE'],
+                         'django.db.backends.postgresql')
+        self.assertTrue(config['default']['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_begin_immediate_only_for_writes(self):
+        def begins(block):
+            with CaptureQueriesContext(connection) as queries:
+                with block():
+                    User.objects.exists()
+            return [query['sql'] for query in queries
+                    if query['sql'].startswith('BEGIN')]
+
+        self.assertEqual(begins(transaction.atomic), ['BEGIN'])
+        self.assertEqual(begins(write_atomic), ['BEGIN IMMEDIATE'])
+        self.assertEqual(begins(transaction.atomic), ['BEGIN'])
+
+    def test_write_burst(self):
+        user = User.objects.create_user(username='burst')
+        Post.objects.create(text='Пост', author=user)
+        path = os.path.join(tempfile.mkdtemp(), 'burst.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        target = sqlite3.connect(path)
+        connection.connection.backup(target)
+        target.close()
+        stats = benchmark.write_burst(path, SQLITE_PRAGMAS, readers=2,
+                                      writers=1, duration=0.3)
+        self.assertGreater(stats['reads_per_s'], 0)
+        self.assertGreater(stats['write_commits_per_s'], 0)
+        self.assertEqual(stats['locked_errors'], 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'реплика - копия файла SQLite')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(TransactionTestCase):
+    """
+    Основная база - тестовая default, реплика - отдельный файл SQLite.
+    Репликацию изображает replicate(): копия default в файл реплики.
+    """
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        connections.databases['replica'] = dict(
+            connection.settings_dict,
+            NAME=os.path.join(directory, 'replica.sqlite3'), TEST={},
+        )
+        self.addCleanup(self.drop_replica)
+        self.user = User.objects.create_user(username='writer',
+                                             password='secret')
+        Post.objects.create(text='Уже на реплике', author=self.user)
+        self.replicate()
+        self.client.login(username='writer', password='secret')
+        self.client.cookies.pop(PIN_COOKIE, None)
+
+    def drop_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+
+    def replicate(self):
+        connections['replica'].close()
+        connection.ensure_connection()
+        target = sqlite3.connect(connections.databases['replica']['NAME'])
+        connection.connection.backup(target)
+        target.close()
+
+    def texts(self, client):
+        response = client.get(reverse('profile', args=['writer']))
+        return [post.text for post in response.context['page']]
+
+    def test_reads_from_replica(self):
+        Post.objects.create(text='Ещё не реплицирован', author=self.user)
+        self.assertEqual(self.texts(self.client), ['Уже на реплике'])
+        self.replicate()
+        self.assertEqual(self.texts(self.client)[0], 'Ещё не реплицирован')
+
+    def test_read_your_writes(self):
+        response = self.client.post(reverse('new_post'),
+                                    {'text': 'Свой пост'})
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.texts(self.client)[0], 'Свой пост')
+        other = Client()
+        other.force_login(User.objects.create_user(username='reader'))
+        self.assertEqual(self.texts(other), ['Уже на реплике'])
+        self.client.cookies[PIN_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self.texts(self.client), ['Уже на реплике'])
+
+    def test_page_cache_filled_from_primary(self):
+        anonymous = Client()
+        self.assertEqual(self.texts(anonymous), ['Уже на реплике'])
+        Post.objects.create(text='Ещё не реплицирован', author=self.user)
+        # Пост сбросил кэш профиля, реплика отстаёт: страница для кэша
+        # всё равно собирается по основной базе.
+        self.assertEqual(self.texts(anonymous)[0], 'Ещё не реплицирован')
+
+    def test_writes_and_forms_use_primary(self):
+        post = Post.objects.create(text='Новый', author=self.user)
+        response = self.client.get(
+            reverse('post', args=['writer', post.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class WriteQueueTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(
+            WRITE_BEHIND=True,
+            WRITE_QUEUE_PATH=os.path.join(directory, 'queue.sqlite3'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(writequeue.close)
+        self.author = User.objects.create_user(username='queue_author')
+        self.reader = User.objects.create_user(username='queue_reader')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+        self.client.force_login(self.reader)
+
+    def comment(self, text, form_key='form'):
+        return self.client.post(
+            reverse('add_comment', args=['queue_author', self.post.pk]),
+            {'text': text, 'form_key': form_key}
+        )
+
+    def test_comments(self):
+        self.assertEqual(self.comment('Первый').status_code, 302)
+        self.comment('Первый')
+        self.comment('Второй')
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(writequeue.pending(), 2)
+        self.assertEqual(writequeue.apply_pending(), 2)
+        self.assertEqual(
+            list(Comment.objects.order_by('pk').values_list('text',
+                                                            flat=True)),
+            ['Первый', 'Второй']
+        )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+        self.assertEqual(writequeue.pending(), 0)
+
+    def test_follow_order(self):
+        self.client.get(reverse('profile_follow', args=['queue_author']))
+        self.client.get(reverse('profile_unfollow', args=['queue_author']))
+        self.client.get(reverse('profile_follow', args=['queue_author']))
+        self.client.get(reverse('profile_unfollow', args=['queue_author']))
+        self.assertFalse(Follow.objects.exists())
+        call_command('apply_writes', once=True, stdout=StringIO())
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(UserStats.objects.get(
+            user=self.author
+        ).following_count, 0)
+
+    def test_replay_after_crash(self):
+        self.comment('Один раз')
+        rows = writequeue._queue().execute(
+            'SELECT key, kind, payload FROM writes'
+        ).fetchall()
+        # Пачка применена, но воркер упал до удаления её из журнала.
+        writequeue.apply([(key, kind, json.loads(payload))
+                          for key, kind, payload in rows])
+        writequeue.apply_pending()
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_repeat_without_form_key(self):
+        self.comment('Ещё раз', form_key='')
+        self.comment('Ещё раз', form_key='')
+        self.assertEqual(writequeue.apply_pending(), 2)
+        self.assertEqual(Comment.objects.count(), 2)
+
+    @override_settings(WRITE_BEHIND=False)
+    def test_inline_repeats(self):
+        self.comment('Ещё раз')
+        self.comment('Ещё раз')
+        self.client.get(reverse('profile_follow', args=['queue_author']))
+        self.assertEqual(Comment.objects.count(), 2)
+        self.assertFalse(AppliedWrite.objects.exists())
+
+    def test_comment_form_has_key(self):
+        response = self.client.get(
+            reverse('add_comment', args=['queue_author', self.post.pk])
+        )
+        self.assertRegex(response.content.decode(),
+                         r'name="form_key" value="[0-9a-f]{32}"')
+
+    def test_deleted_post(self):
+        self.comment('Опоздал')
+        self.post.delete()
+        self.assertEqual(writequeue.apply_pending(), 1)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_deleted_users(self):
+        self.comment('Удалюсь')
+        self.client.get(reverse('profile_follow', args=['queue_author']))
+        self.reader.delete()
+        self.assertEqual(writequeue.apply_pending(), 2)
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Follow.objects.exists())
+
+    @override_settings(WRITE_QUEUE_MAX_ATTEMPTS=2)
+    def test_failing_operation_moved_out(self):
+        def fail():
+            raise RuntimeError('сбой')
+
+        self.comment('До', form_key='1')
+        writequeue.submit('fail')
+        self.comment('После', form_key='2')
+        with mock.patch.dict(writequeue.OPERATIONS, fail=fail), \
+                self.assertLogs('posts.writequeue', 'ERROR'):
+            self.assertEqual(writequeue.apply_pending(), 1)
+            self.assertEqual(writequeue.apply_pending(), 2)
+        self.assertEqual(
+            list(Comment.objects.order_by('pk').values_list('text',
+                                                            flat=True)),
+            ['До', 'После']
+        )
+        self.assertEqual(writequeue.pending(), 0)
+        self.assertEqual(writequeue.failed(), 1)
+
+
+@override_settings(TASKS_EAGER=False, TASK_RETRY_DELAY=5)
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='task_author')
+        self.reader = User.objects.create_user(username='task_reader')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.calls = []
+
+        @taskqueue.task(name='tests.flaky', max_attempts=2)
+        def flaky(value):
+            self.calls.append(value)
+            raise ValueError('сбой')
+
+        self.addCleanup(taskqueue.REGISTRY.pop, 'tests.flaky')
+
+    def test_post_hooks_deferred(self):
+        post = Post.objects.create(text='Фоновая раскладка', author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(search.search('раскладка').object_list, [])
+        self.assertEqual(taskqueue.run_pending(), 2)
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('user', 'post')),
+            [(self.reader.pk, post.pk)]
+        )
+        self.assertEqual(search.search('раскладка').object_list, [post])
+        stats = taskqueue.stats()
+        self.assertEqual(stats['posts.timeline.fan_out_post']['done'], 1)
+        self.assertEqual(stats['posts.search.index_posts']['queued'], 0)
+
+    def test_same_key_queued_once(self):
+        post = Post.objects.create(text='Пост', author=self.author)
+        for text in ('Раз', 'Два'):
+            post.text = text
+            post.save()
+        self.assertEqual(Task.objects.filter(
+            key=f'search:{post.pk}'
+        ).count(), 1)
+
+    def test_key_race(self):
+        with mock.patch('posts.taskqueue.is_queued', return_value=False):
+            first = taskqueue.enqueue('tests.flaky', 1, key='race')
+            second = taskqueue.enqueue('tests.flaky', 1, key='race')
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+        self.assertEqual(Task.objects.filter(key='race').count(), 1)
+
+    def test_retry_with_backoff(self):
+        taskqueue.enqueue('tests.flaky', 1)
+        self.assertEqual(taskqueue.run_pending(), 1)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts),
+                         (Task.QUEUED, 1))
+        self.assertGreater(task.run_at, task.created)
+        self.assertEqual(taskqueue.run_pending(), 0)
+        Task.objects.update(run_at=task.created)
+        self.assertEqual(taskqueue.run_pending(), 1)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts),
+                         (Task.FAILED, 2))
+        self.assertIn('сбой', task.last_error)
+        self.assertEqual(self.calls, [1, 1])
+        stats = taskqueue.stats()['tests.flaky']
+        self.assertEqual((stats['failed'], stats['retries']), (1, 1))
+        output = StringIO()
+        call_command('worker', stats=True, stdout=output)
+        self.assertEqual(json.loads(output.getvalue())['tests.flaky'], stats)
+
+    def test_expired_lease(self):
+        taskqueue.enqueue('tests.flaky', 2)
+        [stale] = taskqueue.claim()
+        self.assertEqual(taskqueue.claim(), [])
+        Task.objects.update(locked_until=stale.run_at)
+        [fresh] = taskqueue.claim()
+        self.assertEqual(fresh.attempts, 2)
+        self.assertIsNone(taskqueue.run(stale))
+        self.assertEqual(self.calls, [])
+        self.assertEqual(Task.objects.get().locked_by, fresh.locked_by)
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_failure_logged(self):
+        with self.assertLogs('posts.taskqueue', 'ERROR'):
+            taskqueue.enqueue('tests.flaky', 3)
+        self.assertEqual(self.calls, [3])
+        self.assertFalse(Task.objects.exists())
+
+
+@override_settings(DIGEST_POSTS_PER_AUTHOR=5)
+class DigestTest(TestCase):
+    def setUp(self):
+        self.first = User.objects.create_user(username='digest_first')
+        self.second = User.objects.create_user(username='digest_second')
+        self.readers = [
+            User.objects.create_user(username=f'reader{number}',
+                                     email=f'reader{number}@yatube.ru')
+            for number in range(3)
+        ]
+        User.objects.create_user(username='no_email')
+        for reader in self.readers:
+            Follow.objects.create(user=reader, author=self.first)
+        Follow.objects.create(user=self.readers[0], author=self.second)
+        Follow.objects.create(user=User.objects.get(username='no_email'),
+                              author=self.first)
+        Post.objects.create(text='До первой рассылки', author=self.first)
+        self.assertEqual(digest.send_digests(), 0)
+        for number in range(7):
+            Post.objects.create(text=f'Пост {number}', author=self.first)
+        Post.objects.create(text='Второй автор', author=self.second)
+
+    def test_digests(self):
+        with mock.patch('posts.digest.render_to_string',
+                        wraps=digest.render_to_string) as render:
+            self.assertEqual(digest.send_digests(batch_size=2), 3)
+        # Два набора авторов в первой пачке и один во второй.
+        self.assertEqual(render.call_count, 3)
+        self.assertEqual([message.to for message in mail.outbox],
+                         [[reader.email] for reader in self.readers])
+        body = mail.outbox[0].body
+        self.assertIn('digest_first (постов: 7)', body)
+        self.assertIn('Пост 6', body)
+        self.assertNotIn('Пост 1', body)
+        self.assertNotIn('До первой рассылки', body)
+        self.assertIn('Второй автор', body)
+        self.assertNotIn('Второй автор', mail.outbox[1].body)
+        self.assertEqual(mail.outbox[1].body, mail.outbox[2].body)
+        self.assertEqual(digest.send_digests(), 0)
+
+    def test_overlapping_runs(self):
+        run = digest.current_run()
+        self.assertTrue(digest.claim(run))
+        # Вторая команда, запущенная поверх первой, ничего не шлёт.
+        self.assertEqual(digest.send_digests(), 0)
+        self.assertEqual(mail.outbox, [])
+        # Не увидев незавершённую рассылку, она не создаст вторую.
+        with mock.patch.object(DigestRun.objects, 'filter',
+                               return_value=DigestRun.objects.none()):
+            self.assertIsNone(digest.current_run())
+        self.assertEqual(DigestRun.objects.filter(
+            finished__isnull=True
+        ).count(), 1)
+        DigestRun.objects.update(locked_until=None)
+        self.assertEqual(digest.send_digests(), 3)
+
+    def test_lease_taken_over(self):
+        def take_over(*args, **kwargs):
+            # Команда зависла, рассылку захватила другая.
+            DigestRun.objects.filter(finished__isnull=True).update(
+                last_user_id=self.readers[2].pk, sent=5,
+                locked_until=timezone.now(),
+            )
+            return render(*args, **kwargs)
+
+        render = digest.render_to_string
+        with mock.patch('posts.digest.render_to_string',
+                        side_effect=take_over):
+            self.assertEqual(digest.send_digests(batch_size=2), 2)
+        run = DigestRun.objects.get(finished__isnull=True)
+        self.assertEqual((run.last_user_id, run.sent),
+                         (self.readers[2].pk, 5))
+
+    def test_resume(self):
+        run = digest.current_run()
+        run.last_user_id = self.readers[1].pk
+        run.save()
+        output = StringIO()
+        call_command('send_digests', stdout=output)
+        self.assertIn('Отправлено писем: 1', output.getvalue())
+        self.assertEqual([message.to for message in mail.outbox],
+                         [[self.readers[2].email]])
+        self.assertFalse(DigestRun.objects.filter(
+            finished__isnull=True
+        ).exists())
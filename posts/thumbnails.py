@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+from yatube.performance import measure
+
+from .models import Post
+from .page_cache import purge_post_pages
+from .taskqueue import task
+
+logger = logging.getLogger(__name__)
+
+# Миниатюра карточки поста в includes/post_item.html.
+CARD_GEOMETRY = '960x339'
+CARD_OPTIONS = {'crop': 'center', 'upscale': True}
+
+
+class ReadyThumbnailBackend(ThumbnailBackend):
+    def get_ready_thumbnail(self, file_, geometry_string, **options):
+        """
+        Как get_thumbnail, но только ищет готовую миниатюру
+        в key-value хранилище и никогда не создаёт её.
+        """
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+
+backend = ReadyThumbnailBackend()
+
+
+def ready_card_thumbnail(image):
+    """
+    Готовая миниатюра карточки или None. Если миниатюры нет,
+    ставит её создание в очередь.
+    """
+    if not image:
+        return None
+    with measure('thumbnail'):
+        thumbnail = backend.get_ready_thumbnail(
+            image, CARD_GEOMETRY, **CARD_OPTIONS
+        )
+    if thumbnail is None:
+        generate_card_thumbnail.delay(image.name,
+                                      key=f'thumbnail:{image.name}')
+    return thumbnail
+
+
+def derivative_formats():
+    """
+    Современные форматы из IMAGE_DERIVATIVE_FORMATS, которые
+    установленный Pillow умеет сохранять.
+    """
+    Image.init()
+    return [fmt for fmt in settings.IMAGE_DERIVATIVE_FORMATS
+            if fmt in Image.SAVE]
+
+
+def build_derivatives(image_name):
+    """
+    Сохраняет копии изображения с кадрированием карточки для каждой
+    ширины из IMAGE_DERIVATIVE_WIDTHS в каждом доступном формате.
+    Возвращает JSON для Post.image_derivatives.
+    """
+    card_width, card_height = map(int, CARD_GEOMETRY.split('x'))
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    with default_storage.open(image_name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert('RGB')
+    derivatives = {}
+    try:
+        for fmt in derivative_formats():
+            files = derivatives[fmt] = []
+            for width in settings.IMAGE_DERIVATIVE_WIDTHS:
+                height = round(width * card_height / card_width)
+                resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+                content = BytesIO()
+                resized.save(content, fmt, quality=80)
+                name = f'posts/derivatives/{stem}-{width}.{fmt.lower()}'
+                # Повторная сборка заменяет прежний файл, а не сохраняет
+                # рядом ещё один под новым именем.
+                default_storage.delete(name)
+                name = default_storage.save(name,
+                                            ContentFile(content.getvalue()))
+                files.append((width, name))
+    except Exception:
+        delete_derivatives(json.dumps(derivatives))
+        raise
+    return json.dumps(derivatives)
+
+
+def _bump(image_name, **changes):
+    posts = Post.objects.filter(image=image_name)
+    posts.update(version=F('version') + 1, **changes)
+    for post in posts.select_related('author'):
+        purge_post_pages(post)
+
+
+@task()
+def generate_card_thumbnail(image_name):
+    """
+    Создаёт миниатюру и заносит её в key-value хранилище sorl, затем
+    сбрасывает закэшированные карточки постов с этой картинкой.
+    Адаптивные копии необязательны: если их не удалось создать,
+    карточка остаётся с одной миниатюрой. Уже созданные копии
+    повторная задача не пересоздаёт.
+    """
+    with measure('thumbnail'):
+        get_thumbnail(image_name, CARD_GEOMETRY, **CARD_OPTIONS)
+    posts = Post.objects.filter(image=image_name)
+    existing = posts.exclude(image_derivatives='').values_list(
+        'image_derivatives', flat=True
+    ).first()
+    if existing:
+        _bump(image_name, image_derivatives=existing)
+        return
+    _bump(image_name)
+    try:
+        with measure('thumbnail'):
+            derivatives = build_derivatives(image_name)
+    except Exception:
+        logger.exception('Не удалось создать копии %s', image_name)
+        return
+    # Копии, которые успела записать параллельная задача, заменяются.
+    previous = set(posts.values_list('image_derivatives', flat=True))
+    _bump(image_name, image_derivatives=derivatives)
+    for old in previous - {'', derivatives}:
+        transaction.on_commit(
+            lambda old=old: delete_derivatives(old, keep=derivatives)
+        )
+
+
+def _names(derivatives):
+    if not derivatives:
+        return []
+    return [name for files in json.loads(derivatives).values()
+            for _, name in files]
+
+
+def delete_derivatives(derivatives, keep=''):
+    """
+    Удаляет файлы адаптивных копий из JSON Post.image_derivatives,
+    кроме файлов из JSON keep.
+    """
+    kept = set(_names(keep))
+    for name in _names(derivatives):
+        if name not in kept:
+            default_storage.delete(name)
+
+
+def schedule(post):
+    """
+    Ставит в очередь создание миниатюры нового изображения поста.
+    """
+    if post.image:
+        generate_card_thumbnail.delay(post.image.name,
+                                      key=f'thumbnail:{post.image.name}')
@@ -0,0 +1,217 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginator import POSTS_PER_PAGE, KeysetPage, KeysetPaginator
+from .taskqueue import task
+
+BATCH_SIZE = 500
+# Список «звёзд» среди подписок читателя кэшируется; смена статуса
+# любого автора меняет общую версию и тем сбрасывает все списки.
+HEAVY_VERSION_KEY = 'timeline:heavy-version'
+HEAVY_TIMEOUT = 10 * 60
+
+
+def is_heavy_author(author_id):
+    """
+    Авторы с большим числом подписчиков не раскладываются по лентам:
+    их посты подмешиваются при чтении (fan-out-on-read).
+    """
+    return UserStats.objects.filter(
+        user_id=author_id,
+        following_count__gte=settings.TIMELINE_FANOUT_LIMIT,
+    ).exists()
+
+
+def _bulk_add(entries):
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def fan_out(post):
+    """
+    Кладёт новый пост в ленты всех подписчиков автора.
+    """
+    if is_heavy_author(post.author_id):
+        return
+    followers = Follow.objects.filter(author_id=post.author_id).values_list(
+        'user_id', flat=True
+    )
+    _bulk_add(
+        TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in followers.iterator()
+    )
+
+
+@task()
+def fan_out_post(post_id):
+    post = Post.objects.filter(pk=post_id).first()
+    if post is not None:
+        fan_out(post)
+
+
+def backfill(user_id, author_id):
+    """
+    Добавляет в ленту подписчика уже опубликованные посты автора.
+    """
+    if is_heavy_author(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'pub_date'
+    )
+    _bulk_add(
+        TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts.iterator()
+    )
+
+
+@task()
+def backfill_author(author_id):
+    """
+    Раскладывает по лентам подписчиков все посты автора, который
+    перестал быть «звездой»: пока он ею был, его посты по лентам
+    не раскладывались.
+    """
+    tables = {
+        'timeline': TimelineEntry._meta.db_table,
+        'follow': Follow._meta.db_table,
+        'post': Post._meta.db_table,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {timeline} (user_id, post_id, pub_date) '
+            'SELECT f.user_id, p.id, p.pub_date FROM {follow} f '
+            'JOIN {post} p ON p.author_id = f.author_id '
+            'WHERE f.author_id = %s AND NOT EXISTS ('
+            'SELECT 1 FROM {timeline} t '
+            'WHERE t.user_id = f.user_id AND t.post_id = p.id)'.format(
+                **tables
+            ),
+            [author_id]
+        )
+
+
+def followers_changed(author_id, delta):
+    """
+    Вызывается после изменения числа подписчиков автора на delta.
+    Если автор пересёк TIMELINE_FANOUT_LIMIT, сбрасывает кэш списков
+    «звёзд», а при переходе вниз дораскладывает его посты.
+    """
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    count = UserStats.objects.filter(user_id=author_id).values_list(
+        'following_count', flat=True
+    ).first()
+    if count == (limit if delta > 0 else limit - 1):
+        cache.set(HEAVY_VERSION_KEY, uuid.uuid4().hex, None)
+        if delta < 0:
+            backfill_author.delay(author_id)
+
+
+def _heavy_key(user_id):
+    version = cache.get(HEAVY_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(HEAVY_VERSION_KEY, version, None)
+    return f'timeline:heavy:{version}:{user_id}'
+
+
+def forget_heavy_authors(user_id):
+    cache.delete(_heavy_key(user_id))
+
+
+def prune(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def touch(post):
+    """
+    post_edit меняет дату публикации - переносим пост в лентах.
+    """
+    TimelineEntry.objects.filter(post=post).update(pub_date=post.pub_date)
+
+
+def rebuild():
+    """
+    Заполняет все ленты заново одним INSERT ... SELECT - для данных,
+    загруженных в обход сигналов (bulk_create, миграции).
+    """
+    TimelineEntry.objects.all().delete()
+    tables = {
+        'timeline': TimelineEntry._meta.db_table,
+        'follow': Follow._meta.db_table,
+        'post': Post._meta.db_table,
+        'stats': UserStats._meta.db_table,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {timeline} (user_id, post_id, pub_date) '
+            'SELECT f.user_id, p.id, p.pub_date FROM {follow} f '
+            'JOIN {post} p ON p.author_id = f.author_id '
+            'LEFT JOIN {stats} s ON s.user_id = f.author_id '
+            'WHERE COALESCE(s.following_count, 0) < %s'.format(**tables),
+            [settings.TIMELINE_FANOUT_LIMIT]
+        )
+
+
+class TimelinePaginator:
+    """
+    Keyset-паджинатор ленты подписок. Основная часть страницы -
+    один проход по индексу (user, pub_date, post) таблицы
+    TimelineEntry; посты авторов-«звёзд» добавляются отдельным
+    запросом и сливаются по тому же ключу (pub_date, id).
+    """
+
+    def __init__(self, user, per_page=POSTS_PER_PAGE):
+        self.user = user
+        self.per_page = per_page
+
+    def heavy_authors(self):
+        key = _heavy_key(self.user.pk)
+        authors = cache.get(key)
+        if authors is None:
+            authors = list(Follow.objects.filter(
+                user=self.user,
+                author__stats__following_count__gte=(
+                    settings.TIMELINE_FANOUT_LIMIT
+                ),
+            ).values_list('author_id', flat=True))
+            cache.set(key, authors, HEAVY_TIMEOUT)
+        return authors
+
+    def page(self, after=None, before=None):
+        fanned = KeysetPaginator(
+            TimelineEntry.objects.filter(user=self.user).select_related(
+                'post__author', 'post__group'
+            ),
+            self.per_page,
+            lookups=('pub_date', 'post_id'),
+        ).page(after, before)
+        fanned.object_list = [entry.post for entry in fanned.object_list]
+        heavy = self.heavy_authors()
+        if not heavy:
+            return fanned
+        pulled = KeysetPaginator(
+            Post.objects.for_feed().filter(author_id__in=heavy),
+            self.per_page,
+        ).page(after, before)
+        rows = {post.pk: post for post in fanned.object_list}
+        rows.update((post.pk, post) for post in pulled.object_list)
+        rows = sorted(rows.values(), key=lambda post: (post.pub_date, post.pk),
+                      reverse=True)
+        overflow = len(rows) > self.per_page
+        if before is not None:
+            return KeysetPage(
+                rows[-self.per_page:], True,
+                overflow or fanned.has_previous() or pulled.has_previous(),
+            )
+        return KeysetPage(
+            rows[:self.per_page],
+            overflow or fanned.has_next() or pulled.has_next(),
+            after is not None,
+        )
@@ -0,0 +1,258 @@
+"""
+Потоковая загрузка изображений постов.
+
+ImageUploadHandler получает файл кусками и до того, как тело загрузки
+окажется в памяти, проверяет заголовок изображения: размер в байтах
+и в пикселях. Небольшие файлы остаются в памяти, крупные сбрасываются
+во временный файл на диске. По пути из JPEG вырезаются метаданные
+EXIF/XMP/IPTC, ориентация снимка сохраняется.
+"""
+import struct
+import tempfile
+from functools import wraps
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (FileUploadHandler,
+                                              StopFutureHandlers)
+from django.utils.translation import gettext as _
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image
+
+# Столько первых байт достаточно, чтобы прочитать заголовок
+# любого поддерживаемого формата вместе с блоками метаданных.
+HEADER_LIMIT = 256 * 1024
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_SOS = 0xDA
+JPEG_APP1 = 0xE1
+JPEG_APP13 = 0xED
+EXIF_HEADER = b'Exif\x00\x00'
+ORIENTATION_TAG = 0x0112
+
+
+def read_orientation(exif):
+    """
+    Значение тега Orientation из блока APP1 Exif или None.
+    """
+    tiff = exif[len(EXIF_HEADER):]
+    try:
+        order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        offset, = struct.unpack_from(order + 'I', tiff, 4)
+        count, = struct.unpack_from(order + 'H', tiff, offset)
+        for index in range(count):
+            entry = offset + 2 + index * 12
+            tag, = struct.unpack_from(order + 'H', tiff, entry)
+            if tag == ORIENTATION_TAG:
+                return struct.unpack_from(order + 'H', tiff, entry + 8)[0]
+    except (KeyError, struct.error):
+        return None
+    return None
+
+
+def orientation_segment(orientation):
+    """
+    Минимальный блок APP1 Exif с одним тегом Orientation.
+    """
+    tiff = (
+        b'MM\x00\x2a' + struct.pack('>I', 8)
+        + struct.pack('>H', 1)
+        + struct.pack('>HHIHH', ORIENTATION_TAG, 3, 1, orientation, 0)
+        + struct.pack('>I', 0)
+    )
+    payload = EXIF_HEADER + tiff
+    length = struct.pack('>H', len(payload) + 2)
+    return bytes([0xFF, JPEG_APP1]) + length + payload
+
+
+class JpegMetadataFilter:
+    """
+    Потоковый фильтр JPEG: до начала сканирования (SOS) разбирает
+    сегменты и выбрасывает APP1 (EXIF, XMP) и APP13 (IPTC). Ориентация
+    из EXIF переписывается в минимальный сегмент. Данные после SOS
+    и файлы других форматов проходят без изменений.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.state = 'start'
+
+    def feed(self, data):
+        if self.state == 'passthrough':
+            return data
+        self.buffer += data
+        output = bytearray()
+        while True:
+            if self.state == 'start':
+                if len(self.buffer) < 2:
+                    break
+                self.state = (
+                    'segments' if self.buffer[:2] == JPEG_SOI else 'passthrough'
+                )
+                if self.state == 'segments':
+                    output += self.buffer[:2]
+                    del self.buffer[:2]
+            elif self.state == 'segments':
+                if len(self.buffer) < 4:
+                    break
+                if self.buffer[0] != 0xFF:
+                    self.state = 'passthrough'
+                    continue
+                marker = self.buffer[1]
+                length, = struct.unpack_from('>H', self.buffer, 2)
+                if len(self.buffer) < length + 2:
+                    break
+                segment = bytes(self.buffer[:length + 2])
+                del self.buffer[:length + 2]
+                if marker == JPEG_APP1:
+                    if segment[4:4 + len(EXIF_HEADER)] == EXIF_HEADER:
+                        orientation = read_orientation(segment[4:])
+                        if orientation and orientation != 1:
+                            output += orientation_segment(orientation)
+                elif marker != JPEG_APP13:
+                    output += segment
+                if marker == JPEG_SOS:
+                    self.state = 'passthrough'
+            else:
+                break
+        if self.state == 'passthrough':
+            output += self.buffer
+            self.buffer.clear()
+        return bytes(output)
+
+    def flush(self):
+        data, self.buffer = bytes(self.buffer), bytearray()
+        return data
+
+
+class SpooledUploadedFile(UploadedFile):
+    """
+    Загруженный файл в памяти или, если он больше порога,
+    во временном файле на диске.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            pass
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """
+    Обработчик загрузки изображений с ограничениями из настроек
+    UPLOAD_IMAGE_MAX_BYTES и UPLOAD_IMAGE_MAX_PIXELS. Отклонённый
+    файл возвращается пустым с причиной в атрибуте upload_error.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        self.request_too_large = (
+            content_length > settings.UPLOAD_IMAGE_MAX_BYTES + HEADER_LIMIT
+        )
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.size = 0
+        self.head = bytearray()
+        self.header_checked = False
+        self.upload_error = None
+        self.filter = JpegMetadataFilter()
+        self.file = BytesIO()
+        if getattr(self, 'request_too_large', False):
+            self.reject(self.too_large_message())
+        raise StopFutureHandlers()
+
+    def too_large_message(self):
+        return _('Файл больше %(size)d МБ.') % {
+            'size': settings.UPLOAD_IMAGE_MAX_BYTES // (1024 * 1024)
+        }
+
+    def reject(self, message):
+        self.upload_error = message
+        self.file.close()
+        self.file = None
+
+    def check_header(self, final=False):
+        try:
+            image = Image.open(BytesIO(self.head))
+            width, height = image.size
+        except Image.DecompressionBombError:
+            self.reject(_('Изображение слишком большое.'))
+            return
+        except Exception:
+            if final or len(self.head) >= HEADER_LIMIT:
+                # Пусть ImageField сообщит о неверном файле как обычно.
+                self.header_checked = True
+            return
+        self.header_checked = True
+        if width * height > settings.UPLOAD_IMAGE_MAX_PIXELS:
+            self.reject(_('Изображение больше %(pixels)d Мпикс.') % {
+                'pixels': settings.UPLOAD_IMAGE_MAX_PIXELS // 10 ** 6
+            })
+
+    def write(self, data):
+        self.file.write(data)
+        if (isinstance(self.file, BytesIO)
+                and self.file.tell() > settings.FILE_UPLOAD_MAX_MEMORY_SIZE):
+            spooled = tempfile.NamedTemporaryFile(
+                suffix='.upload', dir=settings.FILE_UPLOAD_TEMP_DIR
+            )
+            spooled.write(self.file.getvalue())
+            self.file = spooled
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.upload_error:
+            return None
+        self.size += len(raw_data)
+        if self.size > settings.UPLOAD_IMAGE_MAX_BYTES:
+            self.reject(self.too_large_message())
+            return None
+        if not self.header_checked:
+            self.head += raw_data[:HEADER_LIMIT - len(self.head)]
+            self.check_header()
+            if self.upload_error:
+                return None
+        self.write(self.filter.feed(raw_data))
+        return None
+
+    def file_complete(self, file_size):
+        if not self.upload_error and not self.header_checked:
+            self.check_header(final=True)
+        if self.upload_error:
+            uploaded = UploadedFile(
+                BytesIO(), name=self.file_name,
+                content_type=self.content_type, size=0
+            )
+            uploaded.upload_error = self.upload_error
+            return uploaded
+        self.write(self.filter.flush())
+        size = self.file.tell()
+        self.file.seek(0)
+        file_class = (UploadedFile if isinstance(self.file, BytesIO)
+                      else SpooledUploadedFile)
+        return file_class(
+            self.file, name=self.file_name, content_type=self.content_type,
+            size=size, charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+
+
+def image_uploads(view):
+    """
+    Подключает ImageUploadHandler к view. Обработчики загрузки
+    нельзя менять после чтения request.POST, поэтому проверка CSRF
+    переносится внутрь, как описано в документации Django.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [ImageUploadHandler(request)]
+        return protected(request, *args, **kwargs)
+    return wrapper
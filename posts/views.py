@@ -1,33 +1,43 @@
+import hashlib
+import uuid
 from datetime import datetime
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.shortcuts import get_object_or_404, redirect, render
 
+from yatube.routers import replica_reads
+
+from . import writequeue
 from .forms import PostForm, CommentForm
-from .models import Comment, Follow, Group, Post, User
+from .models import Follow, Group, Post, User
+from .page_cache import cache_anonymous_page, conditional_page
+from .paginator import comment_batch, decode_cursor, paginate
+from .search import search
+from .timeline import TimelinePaginator
+from .uploadhandlers import image_uploads
 
 
+@conditional_page('index')
+@cache_anonymous_page('index')
+@replica_reads
 def index(request):
-    post_list = Post.objects.select_related('author', 'group').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, 'index.html',
-                  {'page': page, 'paginator': paginator})
+    post_list = Post.objects.for_feed()
+    return render(request, 'index.html', paginate(request, post_list))
 
 
+@conditional_page('group:{slug}')
+@cache_anonymous_page('group:{slug}')
+@replica_reads
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number) 
+    posts = group.posts.for_feed()
     return render(request, 'group.html',
-                  {'group': group, 'page': page, 'paginator': paginator})
+                  {'group': group, **paginate(request, posts)})
 
 
 @login_required
+@image_uploads
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
@@ -42,22 +52,33 @@ def add_comment(request, username, post_id):
     post = get_object_or_404(Post, author__username=username, id=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
-        form.instance.author = request.user
-        form.instance.post = post
-        form.instance.created = datetime.now()
-        form.save()
+        text = form.cleaned_data['text']
+        # В журнале отложенной записи повторная отправка той же формы
+        # с тем же текстом - дубль. Без form_key (API, старые формы)
+        # каждая отправка - новый комментарий.
+        form_key = request.POST.get('form_key')
+        key = None
+        if settings.WRITE_BEHIND and form_key:
+            digest = hashlib.sha1(
+                f'{post.pk}:{form_key}:{text}'.encode()
+            ).hexdigest()
+            key = f'comment:{request.user.pk}:{digest}'
+        writequeue.submit('comment', key=key, post_id=post.pk,
+                          author_id=request.user.pk, text=text)
         return redirect('post', username=username, post_id=post_id)
-    return render(request, 'includes/comments.html', {'post': post, 'form': form})
+    return render(request, 'includes/comments.html',
+                  {'post': post, 'form': form, 'form_key': uuid.uuid4().hex})
 
 
 @login_required
+@replica_reads
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, 'follow.html',
-                  {'page': page, 'paginator': paginator})
+    post_list = Post.objects.for_feed().filter(
+        author__following__user=request.user
+    )
+    return render(request, 'follow.html', paginate(
+        request, post_list, keyset=TimelinePaginator(request.user)
+    ))
 
 
 @login_required
@@ -65,41 +86,71 @@ def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author == request.user:
         return redirect('profile', username)
-    Follow.objects.get_or_create(user=request.user, author=author)
+    writequeue.submit('follow', user_id=request.user.pk, author_id=author.pk)
     return redirect('profile', username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    user = request.user
     author = get_object_or_404(User, username=username)
-    Follow.objects.filter(user=user, author=author).delete()
+    writequeue.submit('unfollow', user_id=request.user.pk,
+                      author_id=author.pk)
     return redirect('profile', username)
 
 
+@conditional_page('profile:{username}')
+@cache_anonymous_page('profile:{username}')
+@replica_reads
 def profile(request, username):
     user = request.user
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    posts = author.posts.for_feed()
     following = Follow.objects.filter(user__username=user, author=author).exists()
     return render(
         request, 'profile.html',
-        {'author': author, 'page': page,
-         'paginator': paginator, 'following': following}
+        {'author': author, 'following': following,
+         **paginate(request, posts)}
     )
  
  
+@conditional_page('profile:{username}', 'post:{post_id}')
+@cache_anonymous_page('profile:{username}', 'post:{post_id}')
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related('author__stats'),
+        author__username=username, id=post_id
+    )
     form = CommentForm()
-    item = Comment.objects.filter(post=post_id)
+    items, next_cursor = comment_batch(
+        post.comments.all(), decode_cursor(request.GET.get('after'))
+    )
     return render(request, 'post.html', {'post': post,
-                                         'author': post.author, 'items': item, 'form': form})
+                                         'author': post.author, 'items': items,
+                                         'next_cursor': next_cursor,
+                                         'form': form,
+                                         'form_key': uuid.uuid4().hex})
+
+
+@conditional_page('post:{post_id}')
+@cache_anonymous_page('post:{post_id}')
+def post_comments(request, username, post_id):
+    """
+    Следующая порция комментариев для кнопки «Загрузить ещё».
+    """
+    post = get_object_or_404(
+        Post.objects.select_related('author'),
+        author__username=username, id=post_id
+    )
+    items, next_cursor = comment_batch(
+        post.comments.all(), decode_cursor(request.GET.get('after'))
+    )
+    return render(request, 'includes/comment_list.html',
+                  {'post': post, 'items': items, 'next_cursor': next_cursor})
 
 
+@image_uploads
 def post_edit(request, username, post_id):
     post = get_object_or_404(Post, author__username=username, id=post_id)
     form = PostForm(request.POST or None,
@@ -115,6 +166,12 @@ def post_edit(request, username, post_id):
     return render(request, 'new.html', {'form': form, 'post': post})
 
 
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    page = search(query, after=request.GET.get('after'))
+    return render(request, 'search.html', {'query': query, 'page': page})
+
+
 def page_not_found(request, exception):
     return render(
         request,
@@ -0,0 +1,226 @@
+"""
+Отложенная запись комментариев и подписок (write-behind).
+
+Во время пиков add_comment, profile_follow и profile_unfollow не ждут
+блокировку записи основной базы: операция добавляется в журнал -
+отдельный файл SQLite settings.WRITE_QUEUE_PATH, - и запрос сразу
+получает ответ. Команда apply_writes забирает операции пачками
+и применяет каждую пачку одной транзакцией основной базы.
+
+Порядок: журнал читается по возрастанию id одним воркером (его
+держит блокировка файла), поэтому операции одного пользователя
+и одного поста применяются в том порядке, в каком пришли.
+
+Идемпотентность: у каждой операции есть ключ. Повторная отправка
+того же ключа в журнал игнорируется, а ключи применённых операций
+записываются в AppliedWrite в той же транзакции, что и сами
+изменения: если воркер упадёт после коммита, но до удаления пачки
+из журнала, повторный проход её пропустит.
+
+Сбои: операция, которая упала сама (например, пост успели удалить),
+откатывается отдельно. Если не закоммитилась вся пачка, её операции
+применяются по одной; операция, упавшая WRITE_QUEUE_MAX_ATTEMPTS раз,
+переносится из журнала в таблицу failed того же файла, чтобы
+не задерживать следующие.
+
+При WRITE_BEHIND = False операции применяются сразу, тем же кодом,
+но без журнала и без записи ключей.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from yatube.database import apply_pragmas, write_atomic
+
+from .models import AppliedWrite, Comment, Follow, Post, User
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS writes ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, '
+    'kind TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL, '
+    'attempts INTEGER NOT NULL DEFAULT 0)',
+    'CREATE TABLE IF NOT EXISTS failed ('
+    'id INTEGER PRIMARY KEY, key TEXT NOT NULL, kind TEXT NOT NULL, '
+    'payload TEXT NOT NULL, created REAL NOT NULL, error TEXT NOT NULL)',
+)
+# Подтверждённая операция должна пережить сбой питания.
+PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'FULL',
+           'busy_timeout': 5000}
+BATCH_SIZE = 500
+
+_local = threading.local()
+
+
+def _queue():
+    path = settings.WRITE_QUEUE_PATH
+    connection = getattr(_local, 'connection', None)
+    if connection is None or _local.path != path:
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+        apply_pragmas(connection, PRAGMAS)
+        for statement in SCHEMA:
+            connection.execute(statement)
+        _local.connection, _local.path = connection, path
+    return connection
+
+
+def close():
+    connection = getattr(_local, 'connection', None)
+    if connection is not None:
+        connection.close()
+        _local.connection = None
+
+
+# Пост и пользователей могли удалить, пока операция ждала в журнале.
+# Проверять нужно заранее: внешние ключи SQLite отложенные, и нарушение
+# обнаружилось бы только при коммите всей пачки.
+
+def add_comment(post_id, author_id, text):
+    if (Post.objects.filter(pk=post_id).exists()
+            and User.objects.filter(pk=author_id).exists()):
+        Comment.objects.create(post_id=post_id, author_id=author_id,
+                               text=text)
+
+
+def follow(user_id, author_id):
+    if (user_id != author_id
+            and User.objects.filter(pk__in=[user_id, author_id]).count() == 2):
+        Follow.objects.get_or_create(user_id=user_id, author_id=author_id)
+
+
+def unfollow(user_id, author_id):
+    Follow.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+OPERATIONS = {
+    'comment': add_comment,
+    'follow': follow,
+    'unfollow': unfollow,
+}
+
+
+def submit(kind, key=None, **payload):
+    """
+    Принимает операцию kind с аргументами payload. Возвращает ключ.
+    """
+    key = key or uuid.uuid4().hex
+    if not settings.WRITE_BEHIND:
+        # Сразу применённую операцию повторить нельзя, её ключ
+        # запоминать незачем.
+        with transaction.atomic():
+            _apply_one(key, kind, payload)
+        return key
+    _queue().execute(
+        'INSERT OR IGNORE INTO writes (key, kind, payload, created) '
+        'VALUES (?, ?, ?, ?)',
+        (key, kind, json.dumps(payload), time.time())
+    )
+    return key
+
+
+def _apply_one(key, kind, payload):
+    try:
+        with transaction.atomic():
+            OPERATIONS[kind](**payload)
+    except IntegrityError:
+        logger.warning('Операция %s %s не применена', kind, key)
+
+
+def apply(operations):
+    """
+    Применяет операции (ключ, вид, аргументы) одной транзакцией,
+    пропуская уже применённые ключи. Операция, которая упала
+    с IntegrityError, откатывается отдельно и не мешает остальным.
+    """
+    keys = [key for key, _, _ in operations]
+    with write_atomic():
+        done = set(AppliedWrite.objects.filter(key__in=keys).values_list(
+            'key', flat=True
+        ))
+        for key, kind, payload in operations:
+            if key in done:
+                continue
+            _apply_one(key, kind, payload)
+            done.add(key)
+        AppliedWrite.objects.bulk_create(
+            [AppliedWrite(key=key) for key in set(keys)],
+            ignore_conflicts=True
+        )
+
+
+def pending():
+    return _queue().execute('SELECT COUNT(*) FROM writes').fetchone()[0]
+
+
+def failed():
+    return _queue().execute('SELECT COUNT(*) FROM failed').fetchone()[0]
+
+
+def apply_pending(batch_size=BATCH_SIZE):
+    """
+    Применяет следующую пачку из журнала. Возвращает её размер.
+    """
+    queue = _queue()
+    rows = queue.execute(
+        'SELECT id, key, kind, payload, attempts FROM writes '
+        'ORDER BY id LIMIT ?', (batch_size,)
+    ).fetchall()
+    if not rows:
+        return 0
+    try:
+        apply([(key, kind, json.loads(payload))
+               for _, key, kind, payload, _ in rows])
+    except Exception:
+        logger.exception('Пачка журнала не применена, '
+                         'операции применяются по одной')
+        return _apply_singly(queue, rows)
+    queue.execute('DELETE FROM writes WHERE id <= ?', (rows[-1][0],))
+    return len(rows)
+
+
+def _apply_singly(queue, rows):
+    """
+    Применяет операции пачки по одной. На первой упавшей останавливается,
+    чтобы не нарушить порядок, а после WRITE_QUEUE_MAX_ATTEMPTS попыток
+    переносит её в failed. Возвращает число обработанных операций.
+    """
+    for number, (row_id, key, kind, payload, attempts) in enumerate(rows):
+        try:
+            apply([(key, kind, json.loads(payload))])
+        except Exception:
+            if attempts + 1 < settings.WRITE_QUEUE_MAX_ATTEMPTS:
+                queue.execute(
+                    'UPDATE writes SET attempts = attempts + 1 WHERE id = ?',
+                    (row_id,)
+                )
+                return number
+            logger.exception('Операция %s %s перенесена в failed', kind, key)
+            queue.execute(
+                'INSERT OR REPLACE INTO failed '
+                'SELECT id, key, kind, payload, created, ? FROM writes '
+                'WHERE id = ?', (traceback.format_exc(), row_id)
+            )
+        queue.execute('DELETE FROM writes WHERE id = ?', (row_id,))
+    return len(rows)
+
+
+def prune_keys():
+    """
+    Забывает ключи старше WRITE_QUEUE_KEY_TTL: повтор настолько
+    старой операции уже не ожидается.
+    """
+    AppliedWrite.objects.filter(
+        applied__lt=timezone.now() - timedelta(
+            seconds=settings.WRITE_QUEUE_KEY_TTL
+        )
+    ).delete()
@@ -0,0 +1,16 @@
+import shutil
+import tempfile
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings):
+    """
+    Загруженные картинки, миниатюры и их копии - во временном
+    MEDIA_ROOT, который удаляется после теста.
+    """
+    media_root = tempfile.mkdtemp()
+    settings.MEDIA_ROOT = media_root
+    yield media_root
+    shutil.rmtree(media_root, ignore_errors=True)
@@ -0,0 +1,14 @@
+import pytest
+
+
+@pytest.fixture
+def no_n_plus_one():
+    """
+    Контекстный менеджер, который падает, если внутри блока одна
+    и та же форма запроса повторилась больше допустимого:
+
+        with no_n_plus_one():
+            client.get('/')
+    """
+    from yatube.querycheck import check_queries
+    return check_queries
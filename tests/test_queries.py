@@ -0,0 +1,39 @@
+import pytest
+from django.core.cache import cache
+
+
+@pytest.fixture
+def feed(user, group):
+    from posts.models import Comment, Follow, Post, User
+    authors = [
+        User.objects.create_user(username=f'author{number}', password='1234567')
+        for number in range(5)
+    ]
+    posts = []
+    for author in authors:
+        Follow.objects.create(user=user, author=author)
+        post = Post.objects.create(text=f'Пост {author}', author=author, group=group)
+        for reader in authors:
+            Comment.objects.create(post=post, author=reader, text='Комментарий')
+        posts.append(post)
+    cache.clear()
+    return posts
+
+
+class TestNoNPlusOne:
+
+    @pytest.mark.django_db(transaction=True)
+    def test_pages(self, user_client, feed, group, no_n_plus_one):
+        post = feed[0]
+        urls = [
+            '/',
+            f'/group/{group.slug}/',
+            f'/{post.author.username}/',
+            f'/{post.author.username}/{post.id}/',
+            '/follow/',
+        ]
+        for url in urls:
+            with no_n_plus_one(label=url):
+                response = user_client.get(url)
+            assert response.status_code == 200, \
+                f'Страница `{url}` работает неправильно'
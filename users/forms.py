@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
+from django.urls import resolve, reverse
 
 
 User = get_user_model()
@@ -10,3 +11,12 @@ class CreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
         model = User
         fields = ("first_name", "last_name", "username", "email")
+
+    def clean_username(self):
+        username = self.cleaned_data["username"]
+        # Профиль открывается по /<username>/: имя, совпадающее
+        # с адресом другой страницы (search, new, follow, admin...),
+        # сделало бы профиль недоступным.
+        if resolve(reverse("profile", args=[username])).url_name != "profile":
+            raise forms.ValidationError("Это имя пользователя занято.")
+        return username
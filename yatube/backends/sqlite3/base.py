@@ -0,0 +1,24 @@
+from django.db.backends.sqlite3 import base
+
+from yatube.database import apply_pragmas
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite, которая при открытии соединения применяет прагмы из
+    OPTIONS['pragmas'] (см. yatube.database). Транзакция начинается
+    с BEGIN IMMEDIATE, если её открыл write_atomic().
+    """
+    begin_immediate = False
+
+    def get_new_connection(self, conn_params):
+        conn_params = dict(conn_params)
+        pragmas = conn_params.pop('pragmas', {})
+        connection = super().get_new_connection(conn_params)
+        apply_pragmas(connection, pragmas)
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(
+            'BEGIN IMMEDIATE' if self.begin_immediate else 'BEGIN'
+        )
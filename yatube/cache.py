@@ -0,0 +1,306 @@
+"""
+Двухуровневый кэш: небольшой LRU в памяти процесса (L1) перед общим
+для всех воркеров бэкендом (L2).
+
+Каждая запись в L2 публикует сообщение об инвалидации: ключ кладётся
+в журнал процесса внутри того же L2 под очередным номером. У каждого
+процесса свой журнал и свой счётчик, поэтому номера не сталкиваются
+и без атомарного incr() (FileBasedCache, DatabaseCache). Процессы
+с журналами перечислены в реестре. Остальные процессы не чаще раза
+в POLL_INTERVAL секунд читают реестр и номера последних сообщений
+и выбрасывают из L1 перечисленные ключи. Если журнал пропал или
+отстал больше чем на размер L1 - L1 очищается целиком. Время жизни
+записи в L1 дополнительно ограничено L1_TIMEOUT.
+
+Реестр меняется чтением и записью, и одновременная регистрация двух
+процессов может затереть одного из них. Такой процесс возвращается
+в реестр при ближайшем опросе, а его журнал читается с начала,
+поэтому сообщения не теряются.
+
+Пример настройки:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.cache.TieredCache',
+            'LOCATION': 'shared',
+            'OPTIONS': {'L1_MAX_ENTRIES': 1000, 'L1_TIMEOUT': 5},
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': '/var/tmp/yatube_cache',
+        },
+    }
+"""
+import pickle
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.functional import cached_property
+
+from . import performance
+
+ORIGINS_KEY = 'tiered:origins'
+SEQ_KEY = 'tiered:seq:{}'
+LOG_KEY = 'tiered:log:{}:{}'
+# Сообщения и записи реестра молчащих процессов живут столько секунд.
+LOG_TIMEOUT = 10 * 60
+
+_missing = object()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location
+        self._l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        self._l1_timeout = float(options.get('L1_TIMEOUT', 5))
+        self._poll_interval = float(options.get('POLL_INTERVAL', 0.5))
+        self._origin = uuid.uuid4().hex
+        self._l1 = OrderedDict()
+        self._lock = threading.RLock()
+        self._publish_lock = threading.RLock()
+        self._published = 0
+        self._registered_at = None
+        self._seen = None
+        self._polled_at = 0
+        self._stats = Counter()
+
+    @cached_property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def stats(self):
+        """
+        Счётчики попаданий по уровням для подбора размеров кэшей.
+        """
+        with self._lock:
+            return dict(self._stats, l1_entries=len(self._l1))
+
+    # L1
+
+    def _l1_key(self, key, version):
+        return self.shared.make_key(key, version=version)
+
+    def _l1_get(self, l1_key):
+        with self._lock:
+            entry = self._l1.get(l1_key)
+            if entry is None:
+                return _missing
+            expires, pickled = entry
+            if expires < time.monotonic():
+                del self._l1[l1_key]
+                return _missing
+            self._l1.move_to_end(l1_key)
+        return pickle.loads(pickled)
+
+    def _l1_set(self, l1_key, value, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        ttl = self._l1_timeout if timeout is None else min(
+            self._l1_timeout, timeout
+        )
+        if ttl <= 0:
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._l1[l1_key] = (time.monotonic() + ttl, pickled)
+            self._l1.move_to_end(l1_key)
+            while len(self._l1) > self._l1_max_entries:
+                self._l1.popitem(last=False)
+                self._stats['l1_evictions'] += 1
+
+    def _l1_discard(self, l1_keys):
+        with self._lock:
+            for l1_key in l1_keys:
+                self._l1.pop(l1_key, None)
+
+    def _l1_clear(self):
+        with self._lock:
+            self._l1.clear()
+            self._stats['l1_flushes'] += 1
+
+    # Журнал инвалидаций
+
+    def _register(self, origins):
+        """
+        Записывает процесс в реестр, если его там нет или запись пора
+        продлить, и убирает из реестра процессы, молчащие дольше
+        LOG_TIMEOUT.
+        """
+        now = time.time()
+        stamp = origins.get(self._origin)
+        if stamp is not None and now - stamp < LOG_TIMEOUT / 2:
+            return
+        origins = {origin: stamp for origin, stamp in origins.items()
+                   if now - stamp < LOG_TIMEOUT}
+        origins[self._origin] = now
+        self.shared.set(ORIGINS_KEY, origins, None)
+        self._registered_at = now
+
+    def _publish(self, l1_keys):
+        if not l1_keys:
+            return
+        self._sync()
+        with self._publish_lock:
+            if (self._registered_at is None
+                    or time.time() - self._registered_at > LOG_TIMEOUT / 2):
+                self._register(self.shared.get(ORIGINS_KEY) or {})
+            first = self._published + 1
+            self._published += len(l1_keys)
+            # Сначала сообщения, потом номер: кто увидел номер,
+            # найдёт и сообщения.
+            self.shared.set_many({
+                LOG_KEY.format(self._origin, number): l1_key
+                for number, l1_key in enumerate(l1_keys, first)
+            }, LOG_TIMEOUT)
+            self.shared.set(SEQ_KEY.format(self._origin), self._published,
+                            None)
+
+    def _sync(self):
+        now = time.monotonic()
+        if now - self._polled_at < self._poll_interval:
+            return
+        self._polled_at = now
+        origins = self.shared.get(ORIGINS_KEY)
+        if self._published and self._origin not in (origins or {}):
+            # Реестр затёрт одновременной регистрацией или очищен.
+            with self._publish_lock:
+                self._register(origins or {})
+        others = [origin for origin in origins or ()
+                  if origin != self._origin]
+        seqs = self.shared.get_many(
+            [SEQ_KEY.format(origin) for origin in others]
+        )
+        current = {origin: seqs.get(SEQ_KEY.format(origin), 0)
+                   for origin in others}
+        with self._lock:
+            seen, self._seen = self._seen, current
+        if seen is None:
+            return
+        if origins is None and seen:
+            self._l1_clear()
+            return
+        # Процесс, которого раньше не было в реестре, читается
+        # с начала журнала.
+        log_keys = []
+        for origin, seq in current.items():
+            last = seen.get(origin, 0)
+            if seq < last:
+                self._l1_clear()
+                return
+            log_keys.extend(LOG_KEY.format(origin, number)
+                            for number in range(last + 1, seq + 1))
+        if not log_keys:
+            return
+        if len(log_keys) > self._l1_max_entries:
+            self._l1_clear()
+            return
+        messages = self.shared.get_many(log_keys)
+        if len(messages) < len(log_keys):
+            self._l1_clear()
+            return
+        self._l1_discard(messages.values())
+        self._stats['invalidations'] += len(messages)
+
+    # API кэша
+
+    def get(self, key, default=None, version=None):
+        self._sync()
+        l1_key = self._l1_key(key, version)
+        value = self._l1_get(l1_key)
+        if value is not _missing:
+            self._stats['l1_hits'] += 1
+            performance.count('cache_hits')
+            return value
+        value = self.shared.get(key, _missing, version=version)
+        if value is _missing:
+            self._stats['misses'] += 1
+            performance.count('cache_misses')
+            return default
+        self._stats['l2_hits'] += 1
+        performance.count('cache_hits')
+        self._l1_set(l1_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        found = {}
+        rest = []
+        for key in keys:
+            value = self._l1_get(self._l1_key(key, version))
+            if value is _missing:
+                rest.append(key)
+            else:
+                found[key] = value
+        self._stats['l1_hits'] += len(found)
+        misses = 0
+        if rest:
+            shared_found = self.shared.get_many(rest, version=version)
+            misses = len(rest) - len(shared_found)
+            self._stats['l2_hits'] += len(shared_found)
+            self._stats['misses'] += misses
+            for key, value in shared_found.items():
+                self._l1_set(
+                    self._l1_key(key, version), value, DEFAULT_TIMEOUT
+                )
+            found.update(shared_found)
+        performance.count('cache_hits', len(found))
+        performance.count('cache_misses', misses)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        l1_key = self._l1_key(key, version)
+        self._l1_set(l1_key, value, timeout)
+        self._publish([l1_key])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        l1_keys = []
+        for key, value in data.items():
+            l1_key = self._l1_key(key, version)
+            l1_keys.append(l1_key)
+            if key not in failed:
+                self._l1_set(l1_key, value, timeout)
+        self._publish(l1_keys)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            l1_key = self._l1_key(key, version)
+            self._l1_set(l1_key, value, timeout)
+            self._publish([l1_key])
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        l1_key = self._l1_key(key, version)
+        self._l1_discard([l1_key])
+        self._publish([l1_key])
+        return value
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        self.shared.delete_many(keys, version=version)
+        l1_keys = [self._l1_key(key, version) for key in keys]
+        self._l1_discard(l1_keys)
+        self._publish(l1_keys)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def clear(self):
+        self.shared.clear()
+        self._l1_clear()
+        with self._lock:
+            self._seen = {}
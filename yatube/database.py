@@ -0,0 +1,122 @@
+"""
+Настройки DATABASES для разных окружений.
+
+По умолчанию - файл SQLite, настроенный для одновременных чтения
+и записи (бэкенд yatube.backends.sqlite3, прагмы SQLITE_PRAGMAS):
+WAL не блокирует читателей на время записи, busy_timeout заставляет
+писателя подождать блокировку вместо ошибки «database is locked».
+Транзакции, которые читают и затем пишут, открываются write_atomic()
+с BEGIN IMMEDIATE: транзакция, начатая чтением, не может дождаться
+записи - если другой процесс успел записать, SQLite отвечает ошибкой
+сразу, не глядя на busy_timeout. Остальные транзакции блокировку
+записи заранее не берут.
+
+YATUBE_DB=postgresql переключает на PostgreSQL, параметры
+подключения берутся из YATUBE_DB_NAME, YATUBE_DB_USER,
+YATUBE_DB_PASSWORD, YATUBE_DB_HOST и YATUBE_DB_PORT. Соединения
+в обоих случаях живут YATUBE_DB_CONN_MAX_AGE секунд и переиспользуются
+между запросами. Django не держит общий пул соединений: для пула
+ставится PgBouncer в режиме transaction, и тогда YATUBE_DB_PGBOUNCER=1
+отключает серверные курсоры, которые такой пул не поддерживает.
+
+Реплики для чтения (YATUBE_DB_REPLICAS) распределяет
+yatube.routers.ReplicaRouter.
+"""
+import os
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+SQLITE_PRAGMAS = {
+    # Читатели видят последний снимок и не ждут писателя.
+    'journal_mode': 'WAL',
+    # В режиме WAL сбой питания может потерять только последние
+    # транзакции, но не испортить базу.
+    'synchronous': 'NORMAL',
+    # Отрицательное значение - размер кэша страниц в КБ.
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    # Миллисекунды ожидания блокировки.
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+CONN_MAX_AGE = 60
+
+
+def apply_pragmas(connection, pragmas):
+    """
+    Применяет прагмы к соединению sqlite3 (вне транзакции).
+    """
+    for name, value in pragmas.items():
+        connection.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def write_atomic(using=None):
+    """
+    transaction.atomic(), которая на бэкенде yatube.backends.sqlite3
+    сразу берёт блокировку записи. Вложенный блок работает как обычный
+    atomic(): транзакция уже открыта.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using):
+            connection.begin_immediate = False
+            yield
+    finally:
+        connection.begin_immediate = False
+
+
+def sqlite(path, pragmas=None, conn_max_age=CONN_MAX_AGE):
+    return {
+        'ENGINE': 'yatube.backends.sqlite3',
+        'NAME': path,
+        'CONN_MAX_AGE': conn_max_age,
+        'OPTIONS': {
+            'pragmas': SQLITE_PRAGMAS if pragmas is None else pragmas,
+        },
+    }
+
+
+def postgresql(env, conn_max_age=CONN_MAX_AGE):
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': env.get('YATUBE_DB_NAME', 'yatube'),
+        'USER': env.get('YATUBE_DB_USER', 'yatube'),
+        'PASSWORD': env.get('YATUBE_DB_PASSWORD', ''),
+        'HOST': env.get('YATUBE_DB_HOST', 'localhost'),
+        'PORT': env.get('YATUBE_DB_PORT', '5432'),
+        'CONN_MAX_AGE': conn_max_age,
+        'DISABLE_SERVER_SIDE_CURSORS': env.get('YATUBE_DB_PGBOUNCER') == '1',
+        'OPTIONS': {'connect_timeout': 5},
+    }
+
+
+def databases(base_dir, env=os.environ):
+    """
+    Значение для settings.DATABASES: основная база default и реплики
+    replica1, replica2... из YATUBE_DB_REPLICAS (через запятую: пути
+    к файлам SQLite или хосты PostgreSQL). В тестах реплики зеркалят
+    default.
+    """
+    conn_max_age = int(env.get('YATUBE_DB_CONN_MAX_AGE', CONN_MAX_AGE))
+    replicas = [name.strip() for name in
+                env.get('YATUBE_DB_REPLICAS', '').split(',') if name.strip()]
+    if env.get('YATUBE_DB', 'sqlite') == 'postgresql':
+        config = {'default': postgresql(env, conn_max_age)}
+        for number, host in enumerate(replicas, 1):
+            config[f'replica{number}'] = dict(config['default'], HOST=host)
+    else:
+        config = {'default': sqlite(
+            env.get('YATUBE_DB_NAME', os.path.join(base_dir, 'db.sqlite3')),
+            conn_max_age=conn_max_age,
+        )}
+        for number, path in enumerate(replicas, 1):
+            config[f'replica{number}'] = sqlite(
+                path, conn_max_age=conn_max_age
+            )
+    for alias in config:
+        if alias != 'default':
+            config[alias]['TEST'] = {'MIRROR': 'default'}
+    return config
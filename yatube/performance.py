@@ -0,0 +1,140 @@
+"""
+Замеры производительности запросов для продакшена.
+
+PerformanceMiddleware для доли запросов PERFORMANCE_SAMPLE_RATE
+собирает время ответа, число и время SQL-запросов, попадания
+и промахи кэша, время рендеринга шаблонов и работы с миниатюрами.
+Итог отдаётся заголовком Server-Timing и пишется JSON-строкой
+в логгер yatube.performance.
+
+Остальной код отмечает свою работу через measure() и count(); вне
+замеряемого запроса они почти ничего не стоят.
+"""
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+from django.template.backends.django import Template as DjangoTemplate
+
+logger = logging.getLogger('yatube.performance')
+
+_metrics = ContextVar('performance_metrics', default=None)
+
+
+class Metrics:
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+
+
+@contextmanager
+def measure(name):
+    """
+    Прибавляет время выполнения блока к метрике name текущего запроса.
+    """
+    metrics = _metrics.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.durations[name] += time.perf_counter() - started
+
+
+def count(name, value=1):
+    metrics = _metrics.get()
+    if metrics is not None:
+        metrics.counts[name] += value
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    with measure('db'):
+        count('db_queries')
+        return execute(sql, params, many, context)
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.PERFORMANCE_SAMPLE_RATE:
+            return self.get_response(request)
+        metrics = Metrics()
+        token = _metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(_db_wrapper)
+                    )
+                response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        total = time.perf_counter() - started
+        response['Server-Timing'] = self.server_timing(metrics, total)
+        logger.info(json.dumps(self.record(request, response, metrics, total),
+                               ensure_ascii=False))
+        return response
+
+    @staticmethod
+    def server_timing(metrics, total):
+        durations, counts = metrics.durations, metrics.counts
+        return ', '.join([
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={durations["db"] * 1000:.1f};'
+            f'desc="{counts["db_queries"]} queries"',
+            f'cache;desc="{counts["cache_hits"]} hits, '
+            f'{counts["cache_misses"]} misses"',
+            f'template;dur={durations["template"] * 1000:.1f}',
+            f'thumbnail;dur={durations["thumbnail"] * 1000:.1f}',
+        ])
+
+    @staticmethod
+    def record(request, response, metrics, total):
+        match = request.resolver_match
+        durations, counts = metrics.durations, metrics.counts
+        return {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_queries': counts['db_queries'],
+            'db_ms': round(durations['db'] * 1000, 2),
+            'cache_hits': counts['cache_hits'],
+            'cache_misses': counts['cache_misses'],
+            'template_ms': round(durations['template'] * 1000, 2),
+            'thumbnail_ms': round(durations['thumbnail'] * 1000, 2),
+        }
+
+
+class Template(DjangoTemplate):
+    def render(self, context=None, request=None):
+        with measure('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Бэкенд шаблонов Django, который засекает время рендеринга
+    для PerformanceMiddleware. Вложенные {% include %} входят во время
+    шаблона, который их подключил.
+    """
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return Template(template.template, self)
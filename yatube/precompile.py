@@ -0,0 +1,52 @@
+"""
+Разбор всех шаблонов проекта при старте.
+
+С кэширующим загрузчиком (DEBUG = False) разобранные шаблоны остаются
+в памяти, и первый запрос после выкладки не тратит время на парсинг.
+Заодно синтаксические ошибки в любом шаблоне видны сразу при запуске,
+а не на первой открывшей его странице.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+from django.template import TemplateSyntaxError, engines
+
+
+def template_names(engine):
+    """
+    Имена всех шаблонов в каталогах загрузчиков движка.
+    """
+    names = set()
+    for loader in engine.template_loaders:
+        for source in getattr(loader, 'loaders', [loader]):
+            for directory in source.get_dirs():
+                for root, _, files in os.walk(directory):
+                    names.update(
+                        os.path.relpath(os.path.join(root, name), directory)
+                        for name in files
+                    )
+    return sorted(names)
+
+
+def precompile_templates():
+    """
+    Загружает каждый шаблон каждого движка Django. Возвращает число
+    шаблонов, при ошибках поднимает ImproperlyConfigured со списком.
+    """
+    total = 0
+    errors = []
+    for backend in engines.all():
+        engine = getattr(backend, 'engine', None)
+        if engine is None:
+            continue
+        for name in template_names(engine):
+            try:
+                engine.get_template(name)
+            except TemplateSyntaxError as error:
+                errors.append(f'{name}: {error}')
+            total += 1
+    if errors:
+        raise ImproperlyConfigured(
+            'Ошибки в шаблонах:\n' + '\n'.join(errors)
+        )
+    return total
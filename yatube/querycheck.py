@@ -0,0 +1,177 @@
+"""
+Поиск N+1 и медленных SQL-запросов.
+
+QueryChecker подключается к соединениям через execute_wrapper и
+группирует запросы по форме: SQL без литералов, где IN (...) любой
+длины сведён к одному виду. Каждый запрос привязывается к месту,
+откуда он пришёл: к строке шаблона, если он выполнен при рендеринге
+(например, {{ item.author.username }} без select_related), иначе
+к строке кода проекта. Форма, повторившаяся больше threshold раз,
+- вероятный N+1.
+
+Детектор включается только явно: в разработке - настройкой
+QUERY_CHECK_THRESHOLD или QUERY_CHECK_SLOW_MS (QueryCheckMiddleware),
+в тестах - через check_queries() или фикстуру no_n_plus_one.
+"""
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+logger = logging.getLogger('yatube.querycheck')
+
+# Сколько одинаковых запросов допускают check_queries() и фикстура
+# no_n_plus_one, если порог не задан явно.
+DEFAULT_THRESHOLD = 3
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|%s|\b\d+(?:\.\d+)?\b")
+IN_LIST = re.compile(r'\bIN \((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+SPACES = re.compile(r'\s+')
+# Служебные запросы тестовых транзакций не показательны.
+IGNORED = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+SKIPPED_FILES = {os.path.abspath(__file__)}
+
+
+class QueryCheckError(AssertionError):
+    pass
+
+
+def shape(sql):
+    """
+    Форма запроса: литералы и параметры заменены на ?, IN (...)
+    любой длины - одного вида.
+    """
+    sql = LITERALS.sub('?', sql)
+    sql = IN_LIST.sub('IN (...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+def _is_project_file(filename):
+    filename = os.path.abspath(filename)
+    return (filename.startswith(settings.BASE_DIR + os.sep)
+            and 'site-packages' not in filename
+            and filename not in SKIPPED_FILES)
+
+
+def origin():
+    """
+    Откуда выполняется запрос: строка шаблона, если он выполняется
+    при рендеринге, иначе самая глубокая строка кода проекта.
+    """
+    code = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        # type(), а не isinstance(): self может оказаться ленивым
+        # объектом, и проверка его класса выполнила бы новый запрос.
+        if issubclass(type(node), Node) and getattr(node, 'token', None):
+            template = getattr(node.origin, 'template_name', None)
+            return f'{template or node.origin.name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if code is None and _is_project_file(filename):
+            code = (f'{os.path.relpath(filename, settings.BASE_DIR)}:'
+                    f'{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return code or 'неизвестно'
+
+
+class QueryChecker:
+    def __init__(self, threshold=None, slow_ms=None):
+        self.threshold = threshold
+        self.slow_ms = slow_ms
+        self.shapes = defaultdict(Counter)
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            if not sql.lstrip().upper().startswith(IGNORED):
+                where = origin()
+                self.shapes[shape(sql)][where] += 1
+                if self.slow_ms is not None and elapsed > self.slow_ms:
+                    self.slow.append((elapsed, sql, where))
+
+    def repeated(self):
+        """
+        Формы, выполненные больше threshold раз: (форма, число,
+        места с числом запросов из каждого).
+        """
+        if self.threshold is None:
+            return []
+        return sorted(
+            ((query, sum(places.values()), places.most_common())
+             for query, places in self.shapes.items()
+             if sum(places.values()) > self.threshold),
+            key=lambda item: -item[1]
+        )
+
+    def problems(self):
+        problems = [
+            f'N+1: {total} запросов одной формы: {query}\n' + '\n'.join(
+                f'    {total_here} x {where}' for where, total_here in places
+            )
+            for query, total, places in self.repeated()
+        ]
+        problems += [
+            f'Медленный запрос {elapsed:.1f} мс из {where}: {sql}'
+            for elapsed, sql, where in self.slow
+        ]
+        return problems
+
+    def report(self, raise_errors=False, label=''):
+        problems = self.problems()
+        if not problems:
+            return
+        prefix = f'{label}: ' if label else ''
+        if raise_errors:
+            raise QueryCheckError(prefix + '\n'.join(problems))
+        for problem in problems:
+            logger.warning(prefix + problem)
+
+
+@contextmanager
+def check_queries(threshold=DEFAULT_THRESHOLD, slow_ms=None,
+                  raise_errors=True, label=''):
+    """
+    Проверяет запросы внутри блока. По умолчанию при N+1 или медленном
+    запросе поднимает QueryCheckError, иначе пишет в лог.
+    """
+    checker = QueryChecker(threshold, slow_ms)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(checker))
+        yield checker
+    checker.report(raise_errors, label)
+
+
+class QueryCheckMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = settings.QUERY_CHECK_THRESHOLD
+        slow_ms = settings.QUERY_CHECK_SLOW_MS
+        if threshold is None and slow_ms is None:
+            return self.get_response(request)
+        checker = QueryChecker(threshold, slow_ms)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(checker))
+            response = self.get_response(request)
+        match = request.resolver_match
+        checker.report(
+            settings.QUERY_CHECK_RAISE,
+            f'{request.method} {request.path}'
+            + (f' ({match.view_name})' if match else '')
+        )
+        return response
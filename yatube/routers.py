@@ -0,0 +1,115 @@
+"""
+Чтение лент с реплик и read-your-writes.
+
+ReplicaRouter отправляет все записи в default. Чтения идут на одну
+из реплик settings.DATABASE_REPLICAS только внутри view, отмеченных
+@replica_reads (ленты), - остальные страницы и формы читают основную
+базу.
+
+Реплика может отставать, поэтому пользователь, который только что
+что-то записал, на REPLICA_PIN_SECONDS секунд прикрепляется
+к основной базе: ReplicaPinMiddleware ставит ему cookie, и редирект
+после add_comment или post_edit показывает его изменение.
+
+Страницы, которые попадут в общий кэш (posts.page_cache), читаются
+из основной базы (read_primary): иначе после сброса области кэш
+заполнила бы отстающая реплика, и старая страница жила бы под новой
+версией до следующего сброса.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+PIN_COOKIE = 'pin_primary'
+
+_replica_allowed = ContextVar('replica_allowed', default=False)
+_request_state = ContextVar('replica_request_state', default=None)
+_primary_only = ContextVar('primary_only', default=False)
+
+
+class RequestState:
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def replica_reads(view):
+    """
+    Разрешает view читать с реплики.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _replica_allowed.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica_allowed.reset(token)
+    return wrapper
+
+
+@contextmanager
+def read_primary():
+    """
+    Внутри блока все чтения идут в основную базу, даже в view
+    с @replica_reads.
+    """
+    token = _primary_only.set(True)
+    try:
+        yield
+    finally:
+        _primary_only.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (not replicas or not _replica_allowed.get()
+                or _primary_only.get()):
+            return None
+        state = _request_state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaPinMiddleware:
+    """
+    Прикрепляет к основной базе запросы, пришедшие в течение
+    REPLICA_PIN_SECONDS после записи.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        state = RequestState(pinned)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state.wrote or request.method not in ('GET', 'HEAD'):
+            seconds = settings.REPLICA_PIN_SECONDS
+            response.set_cookie(PIN_COOKIE, str(time.time() + seconds),
+                                max_age=seconds, httponly=True)
+        return response
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 
+from yatube.database import databases
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -52,6 +54,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.performance.PerformanceMiddleware',
+    'yatube.querycheck.QueryCheckMiddleware',
+    'yatube.routers.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,12 +70,21 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'NAME': 'django',
+        'BACKEND': 'yatube.performance.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # В продакшене шаблоны разбираются один раз и хранятся
+            # в памяти; при старте их заранее загружает yatube.wsgi.
+            'loaders': TEMPLATE_LOADERS if DEBUG else [
+                ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -88,12 +102,14 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
-}
+# SQLite с WAL и постоянными соединениями или PostgreSQL
+# (YATUBE_DB=postgresql), см. yatube/database.py.
+DATABASES = databases(BASE_DIR)
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['yatube.routers.ReplicaRouter']
+# Сколько секунд после записи пользователь читает только основную
+# базу, чтобы видеть свои изменения несмотря на отставание реплик.
+REPLICA_PIN_SECONDS = 5
 
 
 # Password validation
@@ -144,15 +160,127 @@ LOGOUT_REDIRECT_URL = "index"
 
 EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
+DEFAULT_FROM_EMAIL = 'noreply@yatube.ru'
+
+# Дайджесты новых постов для подписчиков (posts.digest): сколько
+# подписчиков обрабатывать за раз и сколько постов автора показывать.
+DIGEST_BATCH_SIZE = 1000
+DIGEST_POSTS_PER_AUTHOR = 5
+# Сколько секунд рассылка принадлежит запустившей её команде;
+# срок продлевается после каждой пачки.
+DIGEST_LEASE_SECONDS = 10 * 60
 
 SITE_ID = 1
 
+# Двухуровневый кэш (см. yatube/cache.py): LRU в памяти процесса
+# перед общим для воркеров бэкендом. Для нескольких воркеров общий
+# бэкенд задаётся переменными окружения, например FileBasedCache.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'yatube.cache.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+        },
+    },
+    'shared': {
+        'BACKEND': os.environ.get(
+            'SHARED_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('SHARED_CACHE_LOCATION', ''),
+    },
 }
 
+# Страницы для анонимных посетителей сбрасываются сигналами при
+# изменении постов, комментариев и групп, таймаут - страховка.
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Фоновые задачи (posts.taskqueue): миниатюры, раскладка постов
+# по лентам, поисковый индекс. При TASKS_EAGER задачи выполняются
+# сразу, иначе их выполняет manage.py worker.
+TASKS_EAGER = DEBUG
+TASK_WORKERS = 2
+# Сколько секунд задача принадлежит захватившему её процессу.
+TASK_LEASE_SECONDS = 300
+# Задержка перед первым повтором упавшей задачи, дальше она
+# удваивается с каждой попыткой.
+TASK_RETRY_DELAY = 5
+# Сколько секунд хранить выполненные задачи.
+TASK_KEEP_SECONDS = 24 * 3600
+
+# Адаптивные копии изображений постов для srcset. Форматы, которые
+# не поддерживает установленный Pillow, пропускаются.
+IMAGE_DERIVATIVE_WIDTHS = (480, 768, 960)
+IMAGE_DERIVATIVE_FORMATS = ('AVIF', 'WEBP')
+
+# Авторы с таким числом подписчиков и больше не раскладываются
+# по лентам при публикации, их посты подмешиваются при чтении.
+TIMELINE_FANOUT_LIMIT = 10000
+
+# Ограничения загружаемых изображений постов. Файлы больше
+# FILE_UPLOAD_MAX_MEMORY_SIZE сбрасываются во временный файл.
+UPLOAD_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+UPLOAD_IMAGE_MAX_PIXELS = 40 * 10 ** 6
+
+# Поисковый индекс: 'auto' - FTS5, если SQLite его поддерживает,
+# 'python' - обратный индекс в таблице posts_searchposting.
+SEARCH_BACKEND = 'auto'
+
+# Доля запросов, для которых PerformanceMiddleware собирает замеры,
+# отдаёт заголовок Server-Timing и пишет строку в лог.
+PERFORMANCE_SAMPLE_RATE = 0.05
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'yatube.performance': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'yatube.querycheck': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'posts.taskqueue': {
+            'handlers': ['console'],
+            'level': 'WARNING' if DEBUG else 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Детектор N+1 и медленных запросов (yatube.querycheck). None -
+# проверка выключена. QUERY_CHECK_THRESHOLD - сколько запросов одной
+# формы допустимо за один HTTP-запрос, QUERY_CHECK_SLOW_MS - порог
+# медленного запроса. Найденное пишется в лог yatube.querycheck или,
+# с QUERY_CHECK_RAISE, поднимает исключение.
+QUERY_CHECK_THRESHOLD = None
+QUERY_CHECK_SLOW_MS = None
+QUERY_CHECK_RAISE = False
+
+# Загрузчик app_directories подключён явно в TEMPLATE_LOADERS, а
+# APP_DIRS несовместим с OPTIONS['loaders'].
+SILENCED_SYSTEM_CHECKS = ['debug_toolbar.W006']
+
+# Отложенная запись комментариев и подписок (posts.writequeue).
+# Включается на время пиков нагрузки вместе с воркером
+# manage.py apply_writes; иначе операции применяются сразу.
+WRITE_BEHIND = False
+WRITE_QUEUE_PATH = os.path.join(BASE_DIR, 'write_queue.sqlite3')
+# Сколько секунд помнить ключи применённых операций.
+WRITE_QUEUE_KEY_TTL = 7 * 24 * 3600
+# После стольких неудачных попыток операция уходит из журнала
+# в таблицу failed.
+WRITE_QUEUE_MAX_ATTEMPTS = 5
+
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
\ No newline at end of file
@@ -21,6 +21,7 @@ urlpatterns += [
         path('about-author/', views.flatpage, {'url': '/about-author/'}, name='about-author'),
         path('about-spec/', views.flatpage, {'url': '/about-spec/'}, name='about-spec'),
         path('terms/', views.flatpage, {'url': '/terms/'}, name='terms'),
+        path('api/v1/', include('posts.api_urls')),
         path("", include("posts.urls")),
 ]
 
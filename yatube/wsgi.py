@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
 application = get_wsgi_application()
+
+# Разбираем шаблоны до первого запроса: ошибка в шаблоне не даст
+# процессу запуститься.
+from yatube.precompile import precompile_templates  # noqa: E402
+
+precompile_templates()